@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Historical backfill of a subreddit, past the ~1000 posts its listings
+reach.
+
+The time range is cut into windows, each crawled through reddit's
+timestamp search (reddit.getwindow) by a pool of threads. A window that
+comes back full may have lost posts to the cap, so it is crawled again
+in halves. Finished windows are checkpointed in the download index, and
+a later run skips them.
+"""
+
+import calendar
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from reddit import getwindow
+
+# Posts reddit hands out for one listing or search before it stops.
+WINDOW_CAP = 1000
+
+# Shortest window worth splitting further, in seconds.
+MIN_WINDOW = 60
+
+# Default window length, in seconds.
+DEFAULT_WINDOW = 7 * 24 * 3600
+
+# Windows crawled at once.
+DEFAULT_WORKERS = 4
+
+# Posts handed to the downloader at a time.
+PAGE_SIZE = 100
+
+# A range of creation times, in whole seconds, both ends included.
+Window = namedtuple('Window', 'start end')
+
+
+def parse_time(value):
+    """
+    Parse a UTC date (YYYY-MM-DD) or a UNIX time into a UNIX time.
+
+    Raises:
+        ValueError when value is neither.
+    """
+    if value.isdigit():
+        return int(value)
+    return calendar.timegm(time.strptime(value, '%Y-%m-%d'))
+
+
+def parse_range(value):
+    """
+    Parse 'START[:END]' (as given to -backfill) into (start, end). END
+    defaults to now.
+
+    Raises:
+        ValueError when value is malformed or END comes before START.
+    """
+    start, _, end = value.partition(':')
+    start = parse_time(start)
+    end = parse_time(end) if end else int(time.time())
+    if end < start:
+        raise ValueError('Backfill range %s ends before it starts.' % value)
+    return start, end
+
+
+def windows(start, end, length):
+    """Return the Windows of length seconds covering start to end, newest first."""
+    spans = []
+    while end >= start:
+        spans.append(Window(max(start, end - length + 1), end))
+        end -= length
+    return spans
+
+
+def halves(window):
+    """Split window in two."""
+    middle = (window.start + window.end) // 2
+    return Window(window.start, middle), Window(middle + 1, window.end)
+
+
+def crawl_window(subreddit, window, stop):
+    """Return every Post reddit lists for window, stopping early once stop is set."""
+    posts = []
+    previd = ''
+    while not stop.is_set():
+        items = getwindow(subreddit, window.start, window.end, previd)
+        if not items:
+            break
+        posts.extend(items)
+        previd = items[-1]['id']
+    return posts
+
+
+def iterpages(subreddit, start, end, index, length=DEFAULT_WINDOW, workers=DEFAULT_WORKERS):
+    """
+    Yield pages of posts in subreddit created from start to end, like
+    reddit.iterpages does for a listing. Windows of length seconds are
+    crawled by workers threads at once; each post is yielded only once.
+
+    A window is recorded as done in index (a DownloadIndex) once all its
+    posts have been taken, that is when the consumer comes back for the
+    page after its last one. Windows already done are skipped. Taken
+    posts may still be waiting to download, so the consumer has to keep
+    them somewhere that outlives the run (redditdownload.py's journal).
+    """
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    futures = {}
+    seen = set()
+
+    def plan(window):
+        status = index.window_status(subreddit, window.start, window.end)
+        if status == 'done':
+            return
+        if status == 'split':
+            for half in halves(window):
+                plan(half)
+            return
+        futures[pool.submit(crawl_window, subreddit, window, stop)] = window
+
+    for window in windows(start, end, length):
+        plan(window)
+
+    try:
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                window = futures.pop(future)
+                # A ListingError from getwindow ends the backfill here.
+                posts = future.result()
+                split = len(posts) >= WINDOW_CAP and window.end - window.start >= MIN_WINDOW
+                if split:
+                    index.record_window(subreddit, window.start, window.end, 'split', len(posts))
+                    for half in halves(window):
+                        futures[pool.submit(crawl_window, subreddit, half, stop)] = half
+
+                new = []
+                for post in posts:
+                    number = int(post['id'], 36)
+                    if number not in seen:
+                        seen.add(number)
+                        new.append(post)
+                for first in range(0, len(new), PAGE_SIZE):
+                    yield new[first:first + PAGE_SIZE]
+                if not split:
+                    index.record_window(subreddit, window.start, window.end, 'done', len(posts))
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark.
+
+Starts a standin.py server, runs redditdownload.py against it in a fresh
+directory and reports posts and megabytes per second, the peak memory of
+the run, the time per pipeline stage from the run's -report and how long
+each kind of request took to serve. Options it after -- are passed on
+to redditdownload.py.
+"""
+
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from os.path import abspath, dirname, join as pathjoin
+
+from downloadindex import scan_files
+from httpsession import STANDIN_ENV
+from standin import add_server_arguments, server_from_arguments
+
+SCRIPT = pathjoin(dirname(abspath(__file__)), 'redditdownload.py')
+
+# redditdownload.py options used when none are given.
+DEFAULT_ARGS = ['-workers', '4', '-host-delay', '0']
+
+
+def run(server, subreddit, extra_args, keep=False):
+    """
+    Run redditdownload.py against server and return the measurements as
+    a dict.
+    """
+    workdir = tempfile.mkdtemp(prefix='redditimagegrab-bench-')
+    dest = pathjoin(workdir, 'out')
+    env = dict(os.environ)
+    env[STANDIN_ENV] = server.url
+    report_file = pathjoin(workdir, 'report.json')
+    command = [sys.executable, SCRIPT, subreddit, dest, '-report', report_file] + extra_args
+    started = time.perf_counter()
+    with open(pathjoin(workdir, 'output.txt'), 'w') as output:
+        returncode = subprocess.call(command, cwd=workdir, env=env, stdout=output, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+    files = downloaded = 0
+    if os.path.isdir(dest):
+        for entry in scan_files(dest):
+            if not entry.name.startswith('.'):
+                files += 1
+                downloaded += entry.stat().st_size
+
+    stages = server.stats()
+    pipeline = {}
+    if os.path.exists(report_file):
+        with open(report_file) as report_data:
+            pipeline = json.load(report_data)
+    report = {
+        'command': command,
+        'returncode': returncode,
+        'seconds': elapsed,
+        'posts': len(server.posts),
+        'posts_per_second': len(server.posts) / elapsed,
+        'files': files,
+        'bytes': downloaded,
+        'megabytes_per_second': downloaded / elapsed / 1e6,
+        'peak_rss': peak_rss,
+        'stages': stages,
+        'pipeline': pipeline.get('stages', {}),
+        'errors': pipeline.get('errors', {}),
+    }
+    if keep:
+        report['workdir'] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def print_report(report):
+    print('Posts:       %d in %.2f s (%.1f posts/s)' % (report['posts'], report['seconds'], report['posts_per_second']))
+    print('Downloaded:  %d files, %.1f MB (%.2f MB/s)' % (report['files'], report['bytes'] / 1e6, report['megabytes_per_second']))
+    print('Peak RSS:    %.1f MB' % (report['peak_rss'] / 1e6))
+    if report['returncode']:
+        print('redditdownload.py exited with code %d' % (report['returncode']))
+    if 'workdir' in report:
+        print('Output kept in %s' % (report['workdir']))
+    print('Pipeline time per stage (ms):')
+    print('    %-18s %8s %7s %9s %9s %9s' % ('stage', 'count', 'errors', 'p50', 'p90', 'p99'))
+    for stage, stats in sorted(report['pipeline'].items()):
+        errors = sum(report['errors'].get(stage, {}).values())
+        print('    %-18s %8d %7d %9.1f %9.1f %9.1f' % (stage, stats['count'], errors,
+                                                     stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000))
+    print('Server time per request (ms):')
+    print('    %-12s %8s %7s %9s %9s %9s' % ('stage', 'requests', 'errors', 'p50', 'p90', 'p99'))
+    for stage, stats in sorted(report['stages'].items()):
+        print('    %-12s %8d %7d %9.1f %9.1f %9.1f' % (stage, stats['requests'], stats['errors'],
+                                                     stats['p50'] * 1000, stats['p90'] * 1000, stats['p99'] * 1000))
+
+
+if __name__ == "__main__":
+    PARSER = ArgumentParser(description='Benchmarks redditdownload.py against a local stand-in server.',
+                            epilog='Options after -- are passed to redditdownload.py (default: %s).' % ' '.join(DEFAULT_ARGS))
+    add_server_arguments(PARSER)
+    PARSER.add_argument('-subreddit', metavar='NAME', default='bench', required=False, help='Subreddit name to ask for.')
+    PARSER.add_argument('-json', default=False, action='store_true', required=False, help='Print the results as JSON.')
+    PARSER.add_argument('-keep', default=False, action='store_true', required=False, help='Keep the downloaded files and output.')
+    # Single-dash options can't go through parse_known_args: -host-delay
+    # would be read as -h.
+    ARGV = sys.argv[1:]
+    EXTRA_ARGS = []
+    if '--' in ARGV:
+        EXTRA_ARGS = ARGV[ARGV.index('--') + 1:]
+        ARGV = ARGV[:ARGV.index('--')]
+    ARGS = PARSER.parse_args(ARGV)
+    try:
+        SERVER = server_from_arguments(ARGS).start()
+    except ValueError as ERROR:
+        PARSER.error(str(ERROR))
+    try:
+        REPORT = run(SERVER, ARGS.subreddit, EXTRA_ARGS or DEFAULT_ARGS, ARGS.keep)
+    finally:
+        SERVER.stop()
+    if ARGS.json:
+        print(json.dumps(REPORT, indent=2))
+    else:
+        print_report(REPORT)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""On-disk SQLite index of downloaded posts."""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Default index file name, created inside the download directory.
+INDEX_NAME = '.redditimagegrab.db'
+
+# Files written by redditdownload.py are named '<post id> - <title>...'.
+FILENAME_RE = re.compile(r'^([0-9a-z]+) - ')
+
+# Suffixes of unfinished downloads and other temporary files.
+TEMP_SUFFIXES = ('.part', '.link', '.post')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    post_id TEXT NOT NULL,
+    url TEXT,
+    status TEXT NOT NULL,
+    path TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    subreddit TEXT,
+    updated REAL,
+    phash INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS downloads_key ON downloads (post_id, url) WHERE url IS NOT NULL;
+CREATE INDEX IF NOT EXISTS downloads_post ON downloads (post_id);
+CREATE INDEX IF NOT EXISTS downloads_sha256 ON downloads (sha256);
+CREATE TABLE IF NOT EXISTS imported (
+    directory TEXT PRIMARY KEY,
+    files INTEGER,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS windows (
+    subreddit TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    posts INTEGER,
+    updated REAL,
+    PRIMARY KEY (subreddit, start, end)
+);
+"""
+
+COLUMNS = ('post_id', 'url', 'status', 'path', 'size', 'sha256', 'subreddit', 'updated', 'phash')
+
+# Columns added after the first release, with their types, so that older
+# index files can be brought up to date.
+ADDED_COLUMNS = (('phash', 'INTEGER'),)
+
+INSERT = 'INSERT OR REPLACE INTO downloads (%s) VALUES (%s)' % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash onto SQLite's signed INTEGER range."""
+    return value - (1 << 64) if value is not None and value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    """Undo to_signed."""
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+
+def scan_files(directory):
+    """
+    Yield a DirEntry for every regular file in directory and the folders
+    below it, leaving out hidden folders (such as thumbnails).
+    """
+    folders = [directory]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.'):
+                        folders.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+
+class DownloadIndex(object):
+    """
+    Index of downloads keyed by reddit post id and source URL.
+
+    Each row records the status of one download ('done', 'wrongtype',
+    'filtered', 'similar' or 'failed') along with the path, size, SHA-256 and
+    perceptual hash of the stored file.
+    Rows added by import_dir have no URL: they stand for a file found on
+    disk and mark the whole post as downloaded.
+
+    The index may be shared between threads; all access is serialised.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        existing = [row['name'] for row in self._db.execute('PRAGMA table_info(downloads)')]
+        if existing:
+            for name, kind in ADDED_COLUMNS:
+                if name not in existing:
+                    self._db.execute('ALTER TABLE downloads ADD COLUMN %s %s' % (name, kind))
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def lookup(self, post_id, url):
+        """
+        Return the row recorded for url in post post_id as a dict, falling
+        back to a row imported from disk for the post. None if neither is
+        known.
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT * FROM downloads WHERE post_id = ? AND (url = ? OR url IS NULL) '
+                'ORDER BY url IS NULL LIMIT 1', (post_id, url)).fetchone()
+        return dict(row) if row else None
+
+    def find_hash(self, sha256, size, ext=None):
+        """
+        Return the path of a stored regular file with the given SHA-256 and
+        size, or None. Paths that have since vanished are passed over, and
+        so are paths not ending in ext when it is given: a file converted
+        by post-processing keeps the hash it was downloaded with, but its
+        contents no longer match other files of the original type.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM downloads WHERE sha256 = ? AND size = ? AND status = 'done'",
+                (sha256, size)).fetchall()
+        for row in rows:
+            if ext is not None and os.path.splitext(row['path'] or '')[1].lower() != ext.lower():
+                continue
+            if row['path'] and os.path.isfile(row['path']) and not os.path.islink(row['path']):
+                return row['path']
+        return None
+
+    def phashes(self):
+        """Return (perceptual hash, path) for every stored file that has one."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT phash, path FROM downloads WHERE phash IS NOT NULL AND status = 'done'").fetchall()
+        return [(to_unsigned(row['phash']), row['path']) for row in rows]
+
+    def record(self, post_id, url, status, path=None, size=None, sha256=None, subreddit=None, phash=None):
+        """Insert or update the row for url in post post_id."""
+        with self._lock:
+            self._db.execute(INSERT, (post_id, url, status, path and os.path.abspath(path), size,
+                                      sha256, subreddit, time.time(), to_signed(phash)))
+            self._db.commit()
+
+    def import_dir(self, directory, subreddit=None, force=False):
+        """
+        Add every previously downloaded file in directory, or in any
+        folder below it (see layout.Layout), to the index.
+
+        This only happens once per directory unless force is set; later
+        calls return straight away.
+
+        Returns:
+            the number of files imported.
+        """
+        directory = os.path.abspath(directory)
+        with self._lock:
+            if not force and self._db.execute('SELECT 1 FROM imported WHERE directory = ?',
+                                              (directory,)).fetchone():
+                return 0
+
+        rows = []
+        now = time.time()
+        for entry in scan_files(directory):
+            match = FILENAME_RE.match(entry.name)
+            if not match or entry.name.endswith(TEMP_SUFFIXES):
+                continue
+            rows.append((match.group(1), None, 'done', entry.path,
+                         entry.stat().st_size, None, subreddit, now, None))
+
+        with self._lock:
+            prefix = os.path.join(directory, '')
+            self._db.execute('DELETE FROM downloads WHERE url IS NULL AND substr(path, 1, ?) = ?',
+                             (len(prefix), prefix))
+            self._db.executemany(INSERT, rows)
+            self._db.execute('INSERT OR REPLACE INTO imported VALUES (?, ?, ?)',
+                             (directory, len(rows), now))
+            self._db.commit()
+        return len(rows)
+
+    def window_status(self, subreddit, start, end):
+        """Return the status recorded for a -backfill time window, or None."""
+        with self._lock:
+            row = self._db.execute('SELECT status FROM windows WHERE subreddit = ? AND start = ? AND end = ?',
+                                   (subreddit, start, end)).fetchone()
+        return row['status'] if row else None
+
+    def record_window(self, subreddit, start, end, status, posts=None):
+        """
+        Record how far a -backfill time window got: 'done' once all its
+        posts were queued, 'split' when it was crawled in halves.
+        """
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO windows VALUES (?, ?, ?, ?, ?, ?)',
+                             (subreddit, start, end, status, posts, time.time()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -22,11 +22,12 @@ class gfycat(object):
         super(gfycat, self).__init__()
 
     def __fetch(self,url, param):
-        import urllib.request, urllib.error, urllib.parse, json
+        import json
+        from httpsession import urlopen
 #        hdr2 = { 'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:28.0) Gecko/20100101 Firefox/28.0' }
         hdr2 = {'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0'}
-        req = urllib.request.Request((url+param), headers=hdr2)
-        connection = urllib.request.urlopen(req).read()
+        with urlopen(url+param, headers=hdr2) as response:
+            connection = response.read()
         connection = connection.decode('utf-8')
         result = namedtuple("result", "raw json")
         return result(raw=connection, json=json.loads(connection))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Shared keep-alive HTTP session used by all the network modules."""
+
+import io
+import os
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+from http.client import InvalidURL, HTTPException
+from urllib.error import HTTPError, URLError
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+import metrics
+from throttle import DEFAULT_RETRIES, RETRY_STATUSES, backoff_delay
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0'
+
+# Number of idle keep-alive connections kept open per host.
+POOL_SIZE = 10
+
+# Seconds to wait for a connection or for the next chunk of a response.
+TIMEOUT = 30
+
+# Errors that can surface while a response body is being read.
+STREAM_ERRORS = (Urllib3Error, HTTPException, requests.exceptions.RequestException, OSError)
+
+# Environment variable holding a base URL (such as http://127.0.0.1:8000)
+# that every request goes to instead, with the original host in the Host
+# header. benchmark.py points it at a standin.py server.
+STANDIN_ENV = 'REDDITIMAGEGRAB_STANDIN'
+
+# Methods that are safe to send again after a failure.
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+_STANDIN = os.environ.get(STANDIN_ENV)
+_SESSION = None
+_LIMITER = None
+_RETRIES = DEFAULT_RETRIES
+_LOCK = threading.Lock()
+
+
+def _new_session(pool_size):
+    new_session = requests.Session()
+    new_session.headers['User-Agent'] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+
+def configure(pool_size=POOL_SIZE, limiter=None, retries=DEFAULT_RETRIES):
+    """
+    Replace the shared session with one that keeps up to pool_size
+    connections open per host, pace every request with limiter (a
+    throttle.HostLimiter) if given and retry failed requests up to
+    retries times. Call it before any worker threads start.
+    """
+    global _SESSION, _LIMITER, _RETRIES
+    with _LOCK:
+        _LIMITER = limiter
+        _RETRIES = retries
+        old_session, _SESSION = _SESSION, _new_session(pool_size)
+    if old_session is not None:
+        old_session.close()
+    return _SESSION
+
+
+def session():
+    """Return the shared requests session, creating it on first use."""
+    global _SESSION
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = _new_session(POOL_SIZE)
+        return _SESSION
+
+
+class Response(object):
+    """
+    A streamed requests response dressed up with the parts of the
+    urllib.request response interface the rest of the code relies on
+    (info, geturl, getcode, read, readinto and close).
+    """
+
+    def __init__(self, response, host=None):
+        self.response = response
+        self.host = host
+        self.raw = response.raw
+        # Let urllib3 undo gzip/deflate while the body is read.
+        self.raw.decode_content = True
+        self.consumed = False
+
+    @property
+    def status(self):
+        return self.response.status_code
+
+    def info(self):
+        return self.response.headers
+
+    def geturl(self):
+        return self.response.url
+
+    def getcode(self):
+        return self.response.status_code
+
+    def read(self, amt=None):
+        try:
+            data = self.raw.read(amt)
+        except STREAM_ERRORS as ERROR:
+            raise URLError(ERROR)
+        if amt is None or not data:
+            self.consumed = True
+        metrics.add_bytes(self.host, len(data))
+        return data
+
+    def readinto(self, b):
+        try:
+            count = self.raw.readinto(b)
+        except STREAM_ERRORS as ERROR:
+            raise URLError(ERROR)
+        if not count:
+            self.consumed = True
+        metrics.add_bytes(self.host, count)
+        return count
+
+    def close(self):
+        # A fully read response hands its connection back to the pool;
+        # anything else has to be dropped.
+        if self.consumed:
+            self.raw.release_conn()
+        else:
+            self.response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def standin_url(url, headers):
+    """
+    Return (url, headers) rewritten to send a request for url to the
+    stand-in server, or unchanged when there is none.
+    """
+    if not _STANDIN:
+        return url, headers
+    parts = urlsplit(url)
+    headers = dict(headers or {})
+    headers['Host'] = parts.netloc
+    return _STANDIN.rstrip('/') + urlunsplit(('', '', parts.path or '/', parts.query, '')), headers
+
+
+def _send(method, url, data, headers, timeout):
+    try:
+        return session().request(method, url, data=data, headers=headers,
+                                 stream=True, timeout=timeout)
+    except (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema,
+            requests.exceptions.InvalidSchema) as ERROR:
+        raise InvalidURL(str(ERROR))
+
+
+def urlopen(url, data=None, headers=None, method=None, timeout=TIMEOUT, retries=None):
+    """
+    Open url through the shared session and return a streaming Response.
+    The request is a POST when data is given, a GET otherwise.
+
+    With a limiter configured, the request waits for its host's turn
+    first and the answer is reported back to it. GET and HEAD requests
+    that fail to connect or get an HTTP 429 or 5xx answer are tried again
+    up to retries times (by default as configured), after a jittered
+    exponential backoff.
+
+    The time until the response headers arrive goes into the per-host
+    request histogram in metrics.
+
+    Raises the same exceptions urllib.request.urlopen would:
+        HTTPError for 4xx and 5xx answers (the body is available from
+        its read method), URLError when the host can't be reached and
+        http.client.InvalidURL for malformed URLs. HostUnavailableError
+        (a URLError) when the limiter has given up on the host for now.
+    """
+    if method is None:
+        method = 'POST' if data is not None else 'GET'
+    if retries is None:
+        retries = _RETRIES
+    if method not in IDEMPOTENT_METHODS:
+        retries = 0
+    host = urlsplit(url).hostname or ''
+    url, headers = standin_url(url, headers)
+    limiter = _LIMITER
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.pace(host)
+        started = time.perf_counter()
+        try:
+            response = _send(method, url, data, headers, timeout)
+        except requests.exceptions.RequestException as ERROR:
+            metrics.observe_host(host, time.perf_counter() - started)
+            error = URLError(ERROR)
+            if limiter is not None:
+                limiter.record(host)
+        else:
+            metrics.observe_host(host, time.perf_counter() - started)
+            if limiter is not None:
+                limiter.record(host, response.status_code, response.headers)
+            if response.status_code < 400:
+                return Response(response, host)
+            try:
+                body = response.content
+            except requests.exceptions.RequestException:
+                body = b''
+            response.close()
+            error = HTTPError(response.url, response.status_code, response.reason,
+                              response.headers, io.BytesIO(body))
+
+        if attempt >= retries or (isinstance(error, HTTPError) and error.code not in RETRY_STATUSES):
+            raise error
+        metrics.count_error('retry', error)
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
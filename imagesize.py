@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Read the dimensions of an image or video from the first bytes of the file."""
+
+import struct
+
+# JPEG start-of-frame markers (the ones that carry the image size).
+JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Matroska/WebM element ids on the way down to a video track's size.
+EBML_HEADER = 0x1A45DFA3
+EBML_SEGMENT = 0x18538067
+EBML_CLUSTER = 0x1F43B675
+EBML_TRACKS = 0x1654AE6B
+EBML_TRACK_ENTRY = 0xAE
+EBML_VIDEO = 0xE0
+EBML_PIXEL_WIDTH = 0xB0
+EBML_PIXEL_HEIGHT = 0xBA
+EBML_CONTAINERS = {EBML_SEGMENT, EBML_TRACKS, EBML_TRACK_ENTRY, EBML_VIDEO}
+
+
+def dimensions(head):
+    """
+    Return (width, height) of the JPEG, PNG, GIF or WebM file that head
+    is the beginning of, or None when head is too short to tell or the
+    format isn't one of those.
+    """
+    head = bytes(head)
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        if len(head) >= 24 and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        return None
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        if len(head) >= 10:
+            return struct.unpack('<HH', head[6:10])
+        return None
+    if head.startswith(b'\xff\xd8'):
+        return _jpeg_dimensions(head)
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return _webm_dimensions(head)
+    return None
+
+
+def _jpeg_dimensions(head):
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return None
+        marker = head[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            # Markers without a payload
+            pos += 2
+            continue
+        length = struct.unpack('>H', head[pos + 2:pos + 4])[0]
+        if marker in JPEG_SOF:
+            if pos + 9 > len(head):
+                return None
+            height, width = struct.unpack('>HH', head[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def _vint(data, pos, strip_marker):
+    """Return (value, next position) of the EBML variable-size integer at pos."""
+    if pos >= len(data):
+        return None, pos
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8 or pos + length > len(data):
+        return None, pos
+    value = first & (mask - 1) if strip_marker else first
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    # All value bits set means "unknown size".
+    if strip_marker and value == (1 << (7 * length)) - 1:
+        value = -1
+    return value, pos + length
+
+
+def _webm_dimensions(head):
+    width = height = None
+    pos = 0
+    while pos < len(head):
+        element, pos = _vint(head, pos, False)
+        size, pos2 = _vint(head, pos, True)
+        if element is None or size is None:
+            return None
+        pos = pos2
+        if element in EBML_CONTAINERS:
+            # Step inside
+            continue
+        if element == EBML_CLUSTER:
+            # Frames start here; the track list didn't come first.
+            return None
+        if size < 0 or pos + size > len(head):
+            return None
+        if element in (EBML_PIXEL_WIDTH, EBML_PIXEL_HEIGHT):
+            value = int.from_bytes(head[pos:pos + size], 'big')
+            if element == EBML_PIXEL_WIDTH:
+                width = value
+            else:
+                height = value
+            if width is not None and height is not None:
+                return width, height
+        pos += size
+    return None
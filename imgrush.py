@@ -9,11 +9,16 @@
 
 import urllib.request, urllib.error, urllib.parse, urllib.request, urllib.parse, urllib.error
 import json
+from httpsession import urlopen
 
 BASE_URL = "https://imgrush.com/"
 API_URL = BASE_URL + "api/"
 
 
+def _request(url, data=None):
+    with urlopen(url, data) as response:
+        return response.read().decode()
+
 def info(hash):
     """
        Returns dict:
@@ -24,20 +29,20 @@ def info(hash):
        * original: string, url of original file
        * type: string, mime type of original file
     """
-    return json.loads(urllib.request.urlopen(API_URL + hash).read().decode())
+    return json.loads(_request(API_URL + hash))
 
 def info_list(hashlist):
     """
         Returns dict:
         * <hash>: dict of info, or None if hash isn't valid. see info() docs
     """
-    return json.loads(urllib.request.urlopen(API_URL + "info?list=" + ",".join(hashlist)).read())
+    return json.loads(_request(API_URL + "info?list=" + ",".join(hashlist)))
 
 def exists(hash):
     """
         Returns boolean
     """
-    return json.loads(urllib.request.urlopen(API_URL + hash + "/exists").read())["exists"]
+    return json.loads(_request(API_URL + hash + "/exists"))["exists"]
 
 def delete(hash):
     """
@@ -50,7 +55,7 @@ def delete(hash):
           404 = There is no file with that hash.
     """
     try:
-        return json.loads(urllib.request.urlopen(API_URL + hash + "/delete").read())["status"]
+        return json.loads(_request(API_URL + hash + "/delete"))["status"]
     except urllib.error.HTTPError as e:
         return json.loads(e.read())
 
@@ -68,7 +73,7 @@ def status(hash):
           404 = There is no file with that hash.
     """
     try:
-        return json.loads(urllib.request.urlopen(API_URL + hash + "/status").read())
+        return json.loads(_request(API_URL + hash + "/status"))
     except urllib.error.HTTPError as e:
         return json.loads(e.read())
 
@@ -86,7 +91,7 @@ def upload(address, url=True, geturl=False):
     """
     if url:
         try:
-            data = json.loads(urllib.request.urlopen(API_URL + "upload/url", urllib.parse.urlencode({'url': address})).read())
+            data = json.loads(_request(API_URL + "upload/url", urllib.parse.urlencode({'url': address})))
             if geturl:
                 return BASE_URL + data["hash"]
             else:
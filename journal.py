@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Append-only journal of a run's progress, so that a run that was killed
+can carry on where it stopped.
+
+Each line is a JSON record of one step:
+
+    {"s": "job", "job": ..., "last": ..., "newest": ..., "stats": {...}}
+        job's place in its listing and its counters
+    {"s": "listed", "job": ..., "post": {...}}
+        a post was taken from the listing
+    {"s": "resolved", "id": ..., "urls": [...], "guessed": ..., "stats": {...}}
+        the post resolved to these direct URLs, which are a guess at the
+        file's URL rather than looked up if guessed is true
+    {"s": "downloading", "id": ..., "url": ...}
+        a download of url was queued
+    {"s": "done", "id": ..., "url": ..., "status": ..., "stats": {...}}
+        the download ended, well or badly
+    {"s": "skipped", "id": ..., "stats": {...}}
+        the post was filtered out or failed to resolve
+
+stats, where given, are the counters of the post's job as of that step,
+so that a post counted just before the run was killed isn't counted
+again, or lost, when it is resumed.
+
+The journal keeps the state these add up to in memory: each job's place
+in its listing and counters, and the posts not finished yet with what
+is known about them. When the file has grown COMPACT_EVERY records
+longer than that state it is rewritten with just the state.
+"""
+
+import json
+import os
+import threading
+
+# Default journal file name, created inside the download directory.
+JOURNAL_NAME = '.redditimagegrab-journal.jsonl'
+
+# Records appended before the file is rewritten from the state.
+COMPACT_EVERY = 10000
+
+
+class Journal(object):
+    """
+    The journal at path, replayed when it is opened.
+
+    Records are flushed to the operating system as they are written, so
+    they survive the process being killed, and synced to disk at the end
+    of every listing page.
+
+    Attributes:
+        cursors - {job: {'last', 'newest', 'stats'}} from the latest
+                  'job' records
+        pending - {post id: {'job', 'post', 'urls', 'left', 'guessed'}}
+                  for posts not finished: the post's fields, its resolved
+                  URLs (None until resolved), the set of those not done
+                  yet and whether the URLs are a guess
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cursors = {}
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._records = 0
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        # The last line of a killed run may be cut short.
+                        continue
+        self._file = None
+        self.compact()
+
+    def _apply(self, record):
+        state = record['s']
+        if state == 'job':
+            self.cursors[record['job']] = {'last': record['last'], 'newest': record['newest'],
+                                           'stats': record['stats']}
+            return
+        if state == 'listed':
+            post = record['post']
+            self.pending[post['id']] = {'job': record['job'], 'post': post, 'urls': None, 'left': None,
+                                        'guessed': False}
+            return
+        entry = self.pending.get(record['id'])
+        if entry is not None and 'stats' in record and entry['job'] in self.cursors:
+            self.cursors[entry['job']]['stats'] = record['stats']
+        if state == 'skipped':
+            self.pending.pop(record['id'], None)
+        elif entry is not None:
+            if state == 'resolved':
+                entry['urls'] = record['urls']
+                entry['left'] = set(record['urls'])
+                entry['guessed'] = bool(record.get('guessed'))
+                if not entry['left']:
+                    del self.pending[record['id']]
+            elif state == 'done' and entry['left'] is not None:
+                entry['left'].discard(record['url'])
+                if not entry['left']:
+                    del self.pending[record['id']]
+
+    def _write(self, records, sync=False):
+        with self._lock:
+            for record in records:
+                self._apply(record)
+                self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            self._records += len(records)
+        if self._records >= COMPACT_EVERY:
+            self.compact()
+
+    def _state_records(self):
+        records = [{'s': 'job', 'job': job, 'last': cursor['last'], 'newest': cursor['newest'],
+                    'stats': cursor['stats']} for job, cursor in self.cursors.items()]
+        for post_id, entry in self.pending.items():
+            records.append({'s': 'listed', 'job': entry['job'], 'post': entry['post']})
+            if entry['urls'] is not None:
+                records.append({'s': 'resolved', 'id': post_id, 'urls': entry['urls'],
+                                'guessed': entry['guessed']})
+                records.extend({'s': 'done', 'id': post_id, 'url': url, 'status': 'done'}
+                               for url in entry['urls'] if url not in entry['left'])
+        return records
+
+    def compact(self):
+        """Rewrite the file with just the current state."""
+        with self._lock:
+            temp_file = self.path + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as out:
+                for record in self._state_records():
+                    out.write(json.dumps(record, separators=(',', ':')) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+            if self._file is not None:
+                self._file.close()
+            os.replace(temp_file, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            self._records = 0
+
+    def resumed_posts(self, job):
+        """
+        Return (post fields, resolved URLs or None, whether they are a
+        guess) for job's unfinished posts, in listing order.
+        """
+        return [(entry['post'], entry['urls'] and [url for url in entry['urls'] if url in entry['left']],
+                 entry['guessed'])
+                for entry in self.pending.values() if entry['job'] == job]
+
+    def page(self, job, posts, last, newest, stats):
+        """Record a page of job's listing: its posts, and the job's place after it."""
+        records = [{'s': 'listed', 'job': job, 'post': post} for post in posts]
+        records.append({'s': 'job', 'job': job, 'last': last, 'newest': newest, 'stats': dict(stats)})
+        self._write(records, sync=True)
+
+    def progress(self, job, newest, stats):
+        """Record job's counters, keeping its place in the listing."""
+        last = self.cursors.get(job, {}).get('last', '')
+        self._write([{'s': 'job', 'job': job, 'last': last, 'newest': newest, 'stats': dict(stats)}])
+
+    def resolved(self, post_id, urls, stats, guessed=False):
+        self._write([{'s': 'resolved', 'id': post_id, 'urls': list(urls), 'guessed': guessed,
+                      'stats': dict(stats)}])
+
+    def downloading(self, post_id, url):
+        self._write([{'s': 'downloading', 'id': post_id, 'url': url}])
+
+    def done(self, post_id, url, status, stats):
+        self._write([{'s': 'done', 'id': post_id, 'url': url, 'status': status, 'stats': dict(stats)}])
+
+    def skipped(self, post_id, stats):
+        self._write([{'s': 'skipped', 'id': post_id, 'stats': dict(stats)}])
+
+    def close(self, clear=False):
+        """Close the journal, deleting it when clear is set (the run completed)."""
+        with self._lock:
+            self._file.close()
+            if clear:
+                os.remove(self.path)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Where downloaded files go and what they are called."""
+
+import os
+import string
+import time
+
+# Characters that can't (or shouldn't) appear in file names, and what
+# they are replaced with.
+SANITIZE = str.maketrans({
+    '/': '\'', '"': '\'', '*': '\'', ':': '-', '?': '\'', '|': '-',
+    '\\': '\'', '>': '\'', '<': '\'', '\n': '-', '\t': '-', '\r': '-', '\0': '',
+})
+
+# Longest file name most filesystems accept, in bytes.
+NAME_MAX = 255
+
+# Room kept free for the '.part' and '.link' suffixes of temporary files.
+TEMP_SUFFIX_BYTES = 5
+
+# Fields a -layout template may use.
+FIELDS = ('subreddit', 'id', 'shard', 'year', 'month', 'day')
+
+
+def sanitize(text):
+    """Replace the characters in text that don't belong in a file name."""
+    return text.translate(SANITIZE)
+
+
+def truncate_bytes(text, limit, encoding='utf-8'):
+    """
+    Return text cut down to at most limit bytes in encoding, without
+    splitting a character.
+    """
+    encoded = text.encode(encoding, 'surrogateescape')
+    if len(encoded) <= limit:
+        return text
+    return encoded[:max(limit, 0)].decode(encoding, 'ignore')
+
+
+def post_fields(item):
+    """Return the template fields for a reddit post."""
+    created = time.gmtime(item.get('created_utc') or 0)
+    return {
+        'subreddit': sanitize(item.get('subreddit') or ''),
+        'id': item['id'],
+        'shard': item['id'][-2:],
+        'year': '%04d' % created.tm_year,
+        'month': '%02d' % created.tm_mon,
+        'day': '%02d' % created.tm_mday,
+    }
+
+
+class Layout(object):
+    """
+    Lays out downloaded files below a job's folder.
+
+    template is a str.format pattern for the sub-folder of each post, with
+    '/' between levels, using the fields in FIELDS: for instance
+    '{year}/{month}' or '{shard}'. An empty template keeps every file
+    directly in the job's folder, as older versions did.
+
+    Files are named '<post id> - <title><number><extension>', with the
+    title sanitized and cut short so that the name fits in max_bytes.
+    """
+
+    def __init__(self, template='', max_bytes=NAME_MAX):
+        self.levels = [level for level in template.split('/') if level]
+        self.max_bytes = max_bytes
+        self._made = set()
+        formatter = string.Formatter()
+        for level in self.levels:
+            for _, field, _, _ in formatter.parse(level):
+                if field is not None and field.split('.')[0].split('[')[0] not in FIELDS:
+                    raise ValueError('Unknown layout field "%s", expected one of %s.' % (field, ', '.join(FIELDS)))
+        sample = dict.fromkeys(FIELDS, 'x')
+        for level in self.levels:
+            try:
+                level.format(**sample)
+            except (ValueError, IndexError, KeyError, AttributeError) as ERROR:
+                raise ValueError('Bad layout "%s": %s' % (template, ERROR))
+
+    def directory(self, root, item):
+        """
+        Return the folder below root for post item, creating it the first
+        time it is asked for.
+        """
+        if not self.levels:
+            return root
+        fields = post_fields(item)
+        parts = []
+        for level in self.levels:
+            part = sanitize(level.format(**fields)).strip()
+            if part and part not in ('.', '..'):
+                parts.append(truncate_bytes(part, self.max_bytes))
+        path = os.path.join(root, *parts)
+        if path not in self._made:
+            os.makedirs(path, exist_ok=True)
+            self._made.add(path)
+        return path
+
+    def filename(self, post_id, title, filenum='', fileext=''):
+        """Return the file name for one file of a post with the given (sanitized) title."""
+        head = '%s - ' % post_id
+        tail = '%s%s' % (filenum, fileext)
+        room = self.max_bytes - TEMP_SUFFIX_BYTES - len(head.encode('utf-8')) - len(tail.encode('utf-8', 'surrogateescape'))
+        return '%s%s%s' % (head, truncate_bytes(title, room), tail)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+JSONL manifests of resolved posts, for running the listing and resolving
+stage (-resolve) and the download stage (-fetch) separately: on other
+machines, at other times, or with another downloader.
+
+Each line is one post:
+
+    {"id": ..., "subreddit": ..., "title": ..., "score": ..., "url": ...,
+     "domain": ..., "over_18": ..., "created_utc": ..., "urls": [...]}
+
+url is the post's link and urls the direct file URLs it resolved to.
+Lines are flushed as they are written, so a manifest can be read while
+it is still being written, for instance through a pipe.
+"""
+
+import json
+import sys
+import threading
+
+from reddit import Post
+
+# File name standing for standard output (-resolve) or input (-fetch).
+STDIO = '-'
+
+# Posts handed to the downloader at a time from each manifest.
+PAGE_SIZE = 100
+
+
+class ManifestWriter(object):
+    """Appends posts and their resolved URLs to the manifest at path, or to out."""
+
+    def __init__(self, path, out=None):
+        self.path = path
+        self.posts = 0
+        self._lock = threading.Lock()
+        self._file = out or open(path, 'a', encoding='utf-8')
+
+    def write(self, post, urls):
+        record = post.as_dict()
+        record['urls'] = list(urls)
+        with self._lock:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self.posts += 1
+
+    def close(self):
+        with self._lock:
+            if self.path != STDIO:
+                self._file.close()
+
+
+def read_manifest(path):
+    """
+    Yield (Post, resolved URLs) for each line of the manifest at path.
+    Lines that aren't a post with a list of URLs, such as the last line
+    of a manifest whose writer was killed, are passed over.
+    """
+    manifest_file = sys.stdin if path == STDIO else open(path, encoding='utf-8')
+    try:
+        for line in manifest_file:
+            try:
+                record = json.loads(line)
+                urls = record.pop('urls')
+                post = Post(**{name: record[name] for name in Post.__slots__ if name in record})
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+            if isinstance(urls, list):
+                yield post, urls
+    finally:
+        if manifest_file is not sys.stdin:
+            manifest_file.close()
+
+
+def iterpages(paths, page_size=PAGE_SIZE):
+    """
+    Yield pages of (Post, resolved URLs) from the manifests at paths,
+    taking up to page_size posts from each in turn so that they are all
+    worked through side by side.
+    """
+    readers = [read_manifest(path) for path in paths]
+    while readers:
+        for reader in list(readers):
+            page = []
+            for entry in reader:
+                page.append(entry)
+                if len(page) >= page_size:
+                    break
+            else:
+                readers.remove(reader)
+            if page:
+                yield page
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Timings and counters for a run, exported as a JSON report or in the
+Prometheus text format.
+
+The numbers live in this module so any part of the pipeline can add to
+them without passing a collector around. Histograms use fixed buckets,
+so memory stays flat however long -watch runs.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix of the exported Prometheus metric names.
+PREFIX = 'redditimagegrab'
+
+_LOCK = threading.Lock()
+_STARTED = time.time()
+_STAGES = {}
+_HOSTS = {}
+_BYTES = Counter()
+_ERRORS = {}
+
+
+class Histogram(object):
+    """Count, sum, maximum and bucketed distribution of some durations."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, share):
+        """
+        Estimate the value share (0 to 100) of the way through the
+        distribution, interpolating inside the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+        rank = share / 100.0 * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and seen + count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / count, self.max)
+            seen += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {'count': self.count, 'sum': self.total,
+                'mean': self.total / self.count if self.count else 0.0, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.counts))}
+
+
+def observe(stage, seconds):
+    """Add seconds spent in stage."""
+    with _LOCK:
+        if stage not in _STAGES:
+            _STAGES[stage] = Histogram()
+        _STAGES[stage].observe(seconds)
+
+
+def observe_host(host, seconds):
+    """Add the seconds host took to answer a request."""
+    with _LOCK:
+        if host not in _HOSTS:
+            _HOSTS[host] = Histogram()
+        _HOSTS[host].observe(seconds)
+
+
+def add_bytes(host, count):
+    """Add count bytes received from host."""
+    with _LOCK:
+        _BYTES[host] += count
+
+
+def count_error(stage, error):
+    """Count the exception error as having happened in stage."""
+    with _LOCK:
+        _ERRORS.setdefault(stage, Counter())[type(error).__name__] += 1
+
+
+@contextmanager
+def timer(stage):
+    """
+    Time the body of a with statement as stage, counting any exception it
+    raises by type before letting it through.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as ERROR:
+        count_error(stage, ERROR)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def report(**extra):
+    """Return everything recorded so far as a dict, with extra added."""
+    with _LOCK:
+        result = {'started': _STARTED, 'seconds': time.time() - _STARTED,
+                  'stages': {stage: histogram.summary() for stage, histogram in _STAGES.items()},
+                  'hosts': {host: histogram.summary() for host, histogram in _HOSTS.items()},
+                  'bytes': dict(_BYTES),
+                  'errors': {stage: dict(errors) for stage, errors in _ERRORS.items()}}
+    result.update(extra)
+    return result
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(name, label, histograms):
+    lines = []
+    for key, histogram in sorted(histograms.items()):
+        seen = 0
+        for bound, count in zip([str(bound) for bound in BUCKETS] + ['+Inf'], histogram.counts):
+            seen += count
+            lines.append('%s_bucket{%s="%s",le="%s"} %d' % (name, label, _label(key), bound, seen))
+        lines.append('%s_sum{%s="%s"} %f' % (name, label, _label(key), histogram.total))
+        lines.append('%s_count{%s="%s"} %d' % (name, label, _label(key), histogram.count))
+    return lines
+
+
+def prometheus(posts=None):
+    """
+    Return everything recorded so far in the Prometheus text format.
+    posts maps subreddit names to Counters of post outcomes.
+    """
+    with _LOCK:
+        lines = ['# HELP %s_stage_seconds Time spent in each stage of the pipeline.' % PREFIX,
+                 '# TYPE %s_stage_seconds histogram' % PREFIX]
+        lines += _histogram_lines('%s_stage_seconds' % PREFIX, 'stage', _STAGES)
+        lines += ['# HELP %s_request_seconds Time until each host answered a request.' % PREFIX,
+                  '# TYPE %s_request_seconds histogram' % PREFIX]
+        lines += _histogram_lines('%s_request_seconds' % PREFIX, 'host', _HOSTS)
+        lines += ['# HELP %s_received_bytes_total Bytes received from each host.' % PREFIX,
+                  '# TYPE %s_received_bytes_total counter' % PREFIX]
+        lines += ['%s_received_bytes_total{host="%s"} %d' % (PREFIX, _label(host), count)
+                  for host, count in sorted(_BYTES.items())]
+        lines += ['# HELP %s_errors_total Exceptions raised in each stage, by type.' % PREFIX,
+                  '# TYPE %s_errors_total counter' % PREFIX]
+        for stage, errors in sorted(_ERRORS.items()):
+            lines += ['%s_errors_total{stage="%s",type="%s"} %d' % (PREFIX, _label(stage), _label(kind), count)
+                      for kind, count in sorted(errors.items())]
+    if posts:
+        lines += ['# HELP %s_posts_total Posts handled for each subreddit, by outcome.' % PREFIX,
+                  '# TYPE %s_posts_total counter' % PREFIX]
+        for subreddit, counts in sorted(posts.items()):
+            lines += ['%s_posts_total{subreddit="%s",result="%s"} %d' % (PREFIX, _label(subreddit), _label(result), count)
+                      for result, count in sorted(counts.items())]
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path, text):
+    # Write next to the target and rename, so readers never see half a file.
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as output:
+        output.write(text)
+    os.replace(temp_path, path)
+
+
+def write_json(path, **extra):
+    """Write report(**extra) to path as JSON."""
+    _write(path, json.dumps(report(**extra), indent=2, sort_keys=True) + '\n')
+
+
+def write_prometheus(path, posts=None):
+    """Write prometheus(posts) to path."""
+    _write(path, prometheus(posts))
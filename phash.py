@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Perceptual hashing of downloaded images for near-duplicate detection.
+
+Needs NumPy and Pillow; available() tells whether they are installed.
+"""
+
+import threading
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = Image = None
+
+# Bits set in every byte value, for NumPy versions without bitwise_count.
+_POPCOUNT = None
+
+
+def available():
+    """Return True if NumPy and Pillow could be imported."""
+    return numpy is not None and Image is not None
+
+
+def dhash(path):
+    """
+    Return the 64-bit difference hash of the image at path, or None when
+    it isn't an image Pillow can read (videos, truncated files, ...).
+
+    The image is shrunk to 9x8 greyscale pixels and each bit records
+    whether a pixel is brighter than its right-hand neighbour, so
+    re-encoded and resized copies of an image hash to the same value or
+    one a few bits away.
+    """
+    try:
+        with Image.open(path) as image:
+            # Let the JPEG decoder scale down while decoding.
+            image.draft('L', (64, 64))
+            pixels = numpy.asarray(image.convert('L').resize((9, 8), Image.LANCZOS), dtype=numpy.int16)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(numpy.packbits(bits).tobytes(), 'big')
+
+
+def hamming(hashes, value):
+    """Return the Hamming distance between each of hashes and value."""
+    global _POPCOUNT
+    diff = numpy.bitwise_xor(hashes, numpy.uint64(value))
+    if hasattr(numpy, 'bitwise_count'):
+        return numpy.bitwise_count(diff)
+    if _POPCOUNT is None:
+        _POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)], dtype=numpy.uint8)
+    return _POPCOUNT[diff.view(numpy.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PHashIndex(object):
+    """
+    In-memory table of perceptual hashes backed by a NumPy uint64 array,
+    with a parallel list of the paths they belong to.
+
+    Queries XOR the new hash against the whole array at once, so checking
+    an image against a few million stored hashes takes milliseconds.
+    """
+
+    def __init__(self, entries=()):
+        self._lock = threading.Lock()
+        self._hashes = numpy.zeros(1024, dtype=numpy.uint64)
+        self._paths = []
+        for value, path in entries:
+            self._append(value, path)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def _append(self, value, path):
+        count = len(self._paths)
+        if count == len(self._hashes):
+            grown = numpy.zeros(count * 2, dtype=numpy.uint64)
+            grown[:count] = self._hashes
+            self._hashes = grown
+        self._hashes[count] = value
+        self._paths.append(path)
+
+    def match_or_add(self, value, path, max_distance):
+        """
+        Look for a stored hash within max_distance bits of value. If there
+        is none, add value for path.
+
+        Returns:
+            (path, distance) of the closest match, or None if value was
+            added.
+        """
+        with self._lock:
+            count = len(self._paths)
+            if count:
+                distances = hamming(self._hashes[:count], value)
+                best = int(numpy.argmin(distances))
+                if distances[best] <= max_distance:
+                    return self._paths[best], int(distances[best])
+            self._append(value, path)
+        return None
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Post-processing of downloaded files in a pool of worker processes:
+thumbnails, metadata stripping and format conversion.
+
+Metadata stripping works on the raw JPEG and PNG structure and needs
+nothing else. Thumbnails and conversion need Pillow; available() tells
+whether it is installed.
+"""
+
+import io
+import multiprocessing
+import os
+import struct
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Folder, next to each processed file, that holds its thumbnail. The dot
+# keeps DownloadIndex.import_dir from taking thumbnails for downloads.
+THUMB_DIR = '.thumbs'
+
+# JPEG quality for thumbnails and converted files.
+QUALITY = 90
+
+# Formats files can be converted to, with Pillow's name and the extension.
+CONVERT_FORMATS = {'jpg': ('JPEG', '.jpg'), 'png': ('PNG', '.png')}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG chunks that only carry metadata.
+PNG_METADATA = {b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'}
+
+# JPEG markers whose segments only carry metadata: APP1 (Exif, XMP),
+# APP3 to APP13, APP15 and comments. APP0 (JFIF), APP2 (ICC profile) and
+# APP14 (Adobe colour transform) change how the image looks and are kept.
+JPEG_METADATA = {0xE1, 0xFE} | set(range(0xE3, 0xEE)) | {0xEF}
+
+# What to do to each file.
+Options = namedtuple('Options', 'thumbnail strip convert', defaults=(0, False, None))
+
+# The outcome for one file: where it is now (converted files get a new
+# extension), its thumbnail, whether metadata was removed, and the
+# seconds it took.
+Processed = namedtuple('Processed', 'path thumbnail stripped seconds')
+
+
+def available():
+    """Return True if Pillow could be imported."""
+    return Image is not None
+
+
+def strip_jpeg(data):
+    """
+    Return the JPEG in data without its metadata segments, or None if
+    there were none. The compressed image itself is copied as is.
+    """
+    if not data.startswith(b'\xff\xd8'):
+        return None
+    kept = [data[:2]]
+    pos = 2
+    dropped = False
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker == 0xDA:
+            # Start of scan: the rest is image data.
+            break
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in JPEG_METADATA:
+            dropped = True
+        else:
+            kept.append(data[pos:pos + 2 + length])
+        pos += 2 + length
+    if not dropped:
+        return None
+    kept.append(data[pos:])
+    return b''.join(kept)
+
+
+def strip_png(data):
+    """Return the PNG in data without its metadata chunks, or None if there were none."""
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    kept = [PNG_SIGNATURE]
+    pos = len(PNG_SIGNATURE)
+    dropped = False
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        end = pos + 12 + length
+        if kind in PNG_METADATA:
+            dropped = True
+        else:
+            kept.append(data[pos:end])
+        pos = end
+        if kind == b'IEND':
+            break
+    return b''.join(kept) if dropped else None
+
+
+def _write(path, data):
+    temp_file = path + '.post'
+    with open(temp_file, 'wb') as out:
+        out.write(data)
+    os.replace(temp_file, path)
+
+
+def _save(image, path, fmt):
+    temp_file = path + '.post'
+    if fmt == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(temp_file, fmt, quality=QUALITY, optimize=True)
+    else:
+        image.save(temp_file, fmt)
+    os.replace(temp_file, path)
+
+
+def thumbnail_path(path):
+    """Return where the thumbnail of the file at path goes."""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, THUMB_DIR, os.path.splitext(name)[0] + '.jpg')
+
+
+def process_file(path, options):
+    """
+    Apply options to the file at path, reading it once. Runs in a worker
+    process. Files that aren't images (videos, ...) are left alone.
+
+    Returns:
+        Processed for the file.
+    """
+    started = time.perf_counter()
+    thumbnail = None
+    stripped = False
+
+    with open(path, 'rb') as infile:
+        data = infile.read()
+
+    image = None
+    if Image is not None and (options.thumbnail or options.convert):
+        try:
+            image = Image.open(io.BytesIO(data))
+            if not options.convert:
+                # Let the JPEG decoder scale down while decoding.
+                image.draft('RGB', (options.thumbnail, options.thumbnail))
+            image.load()
+        except (OSError, ValueError, Image.DecompressionBombError):
+            image = None
+
+    if image is not None and options.convert and not getattr(image, 'is_animated', False):
+        fmt, ext = CONVERT_FORMATS[options.convert]
+        if image.format != fmt:
+            converted = os.path.splitext(path)[0] + ext
+            # Pillow writes no metadata unless asked to.
+            _save(image, converted, fmt)
+            if converted != path:
+                os.remove(path)
+            path = converted
+            stripped = True
+            data = None
+
+    if options.strip and data is not None:
+        clean = strip_jpeg(data) or strip_png(data)
+        if clean is not None:
+            _write(path, clean)
+            stripped = True
+
+    if image is not None and options.thumbnail:
+        thumbnail = thumbnail_path(path)
+        os.makedirs(os.path.dirname(thumbnail), exist_ok=True)
+        image.thumbnail((options.thumbnail, options.thumbnail))
+        _save(image, thumbnail, 'JPEG')
+
+    return Processed(path, thumbnail, stripped, time.perf_counter() - started)
+
+
+class PostProcessor(object):
+    """
+    Runs process_file over finished downloads in a pool of processes.
+
+    At most max_pending files are queued at once. submit only waits when
+    the queue is full, and then in the calling (main) thread: the
+    download threads carry on regardless.
+
+    Worker processes are started with 'spawn', as forking a process that
+    has download threads running can leave locks held in the child.
+    """
+
+    def __init__(self, options, workers=None, max_pending=None):
+        self.options = options
+        workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or workers * 2
+        self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        # Maps each future to the key it was submitted with.
+        self.pending = {}
+        self._done = []
+
+    def submit(self, path, key=None):
+        """Queue the file at path, to be reported back with key."""
+        while len(self.pending) >= self.max_pending:
+            self._collect(None)
+        self.pending[self.pool.submit(process_file, path, self.options)] = key
+
+    def _collect(self, timeout):
+        done, _ = wait(list(self.pending), timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = self.pending.pop(future)
+            try:
+                self._done.append((key, future.result(), None))
+            except (OSError, ValueError) as ERROR:
+                self._done.append((key, None, ERROR))
+
+    def results(self, timeout=0):
+        """
+        Return (key, Processed or None, exception or None) for every file
+        finished since the last call, waiting up to timeout seconds for
+        at least one when none is ready.
+        """
+        if self.pending and not self._done:
+            self._collect(timeout)
+        done, self._done = self._done, []
+        return done
+
+    def close(self):
+        """Wait for the queued files and stop the workers. Returns the remaining results."""
+        while self.pending:
+            self._collect(None)
+        self.pool.shutdown()
+        return self.results()
@@ -2,36 +2,206 @@
 """Return list of items from a sub-reddit of reddit.com."""
 
 import sys
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError
-from json import JSONDecoder
+import threading
+from queue import Queue, Empty, Full
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from httpsession import urlopen
+import metrics
 
+# orjson parses listings several times faster when it is installed.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-def getitems(subreddit, previd=''):
-    """Return list of items from a subreddit."""
-    url = 'http://www.reddit.com/r/%s.json' % subreddit
+
+class ListingError(Exception):
+    """Exception raised when a listing page can't be fetched or read"""
+
+
+class Post(object):
+    """
+    The parts of a reddit post the downloader uses. A listing's child
+    'data' dicts carry dozens of other fields, HTML included, that are
+    dropped here.
+
+    Fields can be read as attributes or, like the dicts they replace,
+    with post['id'] and post.get('id').
+    """
+
+    __slots__ = ('id', 'title', 'url', 'domain', 'score', 'over_18', 'created_utc', 'subreddit')
+
+    def __init__(self, id, title, url, domain, score=0, over_18=False, created_utc=0, subreddit=''):
+        self.id = id
+        self.title = title
+        self.url = url
+        self.domain = domain
+        self.score = score
+        self.over_18 = over_18
+        self.created_utc = created_utc
+        self.subreddit = subreddit
+
+    @classmethod
+    def from_data(cls, data):
+        """Build a Post from a listing child's 'data' dict."""
+        # Domains and subreddits repeat from post to post; share the strings.
+        return cls(data['id'], data['title'], data['url'], sys.intern(data.get('domain') or ''),
+                   data.get('score') or 0, bool(data.get('over_18')),
+                   data.get('created_utc') or 0, sys.intern(data.get('subreddit') or ''))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def as_dict(self):
+        """Return the fields as a dict, which Post(**fields) turns back into the Post."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return 'Post(%r, %r)' % (self.id, self.title)
+
+
+def getlisting(subreddit, previd='', sort=None, etag=None, modified=None):
+    """
+    Return (items, etag, last_modified) for one page of a subreddit's
+    listing, 'hot' unless sort names another one (such as 'new'). items
+    is a list of Posts.
+
+    etag and modified are the validators an earlier call returned. When
+    given the page is requested conditionally, and items is None if the
+    server says it hasn't changed since.
+    """
+    if sort:
+        url = 'http://www.reddit.com/r/%s/%s.json' % (subreddit, sort)
+    else:
+        url = 'http://www.reddit.com/r/%s.json' % subreddit
     # Get items after item with 'id' of previd.
     
 #    hdr = { 'User-Agent' : 'RedditImageGrab script.' }
     hdr = {'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0 '}
+    if etag:
+        hdr['If-None-Match'] = etag
+    if modified:
+        hdr['If-Modified-Since'] = modified
     
     if previd:
         url = '%s?after=t3_%s' % (url, previd)
+    return fetchposts(url, subreddit, hdr)
+
+
+def getwindow(subreddit, start, end, previd=''):
+    """
+    Return the list of Posts on one page of a subreddit's posts created
+    from start to end (UNIX times, both included), newest first, after
+    post previd.
+
+    This goes through reddit's search with a timestamp range, which is
+    capped like any listing but can reach posts of any age.
+    """
+    url = ('http://www.reddit.com/r/%s/search.json?q=%s&restrict_sr=on&sort=new&syntax=cloudsearch'
+           % (subreddit, quote('timestamp:%d..%d' % (start, end))))
+    if previd:
+        url = '%s&after=t3_%s' % (url, previd)
+    hdr = {'User-Agent' : 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0 '}
+    return fetchposts(url, subreddit, hdr)[0]
+
+
+def fetchposts(url, subreddit, hdr):
+    """
+    Fetch the listing page at url and return (items, etag, last_modified)
+    as getlisting does.
+
+    Raises:
+        ListingError when the page can't be had (once httpsession has
+        given up retrying) or isn't a listing.
+    """
     try:
-        req = Request(url, headers=hdr)
-        json = urlopen(req).read().decode('utf-8')
-#        data = json.decode("utf-8")
-        data = JSONDecoder().decode(json)
-        items = [x['data'] for x in data['data']['children']]
+        with metrics.timer('listing'), urlopen(url, headers=hdr) as response:
+            json = response.read()
+            if response.getcode() == 304:
+                return None, hdr.get('If-None-Match'), hdr.get('If-Modified-Since')
+            info = response.info()
+        data = json_loads(json)
+        items = [Post.from_data(x['data']) for x in data['data']['children']]
     except HTTPError as ERROR:
-        error_message = '\tHTTP ERROR: Code %s for %s.' % (ERROR.code, url)
-        sys.exit(error_message)
-    except ValueError as ERROR:
-        if ERROR.args[0] == 'No JSON object could be decoded':
-            error_message = 'ERROR: subreddit "%s" does not exist' % subreddit
-            sys.exit(error_message)
-        raise ERROR
-    return items
+        raise ListingError('HTTP ERROR: Code %s for %s.' % (ERROR.code, url))
+    except URLError as ERROR:
+        raise ListingError('URL ERROR: %s for %s.' % (ERROR.reason, url))
+    except (ValueError, KeyError, TypeError):
+        raise ListingError('ERROR: subreddit "%s" does not exist' % subreddit)
+    return items, info.get('etag'), info.get('last-modified')
+
+
+def getitems(subreddit, previd='', sort=None):
+    """Return list of Posts from a subreddit."""
+    return getlisting(subreddit, previd, sort)[0]
+
+
+def iterpages(subreddit, previd='', readahead=1, sort=None):
+    """
+    Yield successive listing pages of a subreddit, each a list of items as
+    getitems returns it, starting after item previd and stopping at the
+    first empty page. sort picks the listing as for getlisting.
+
+    A background thread fetches up to readahead pages ahead, so the next
+    page is usually waiting by the time the current one is done with. When
+    the consumer falls behind the thread blocks, which keeps memory bounded.
+    With readahead 0 pages are fetched on demand.
+    """
+    if readahead < 1:
+        while True:
+            items = getitems(subreddit, previd, sort)
+            if not items:
+                return
+            yield items
+            previd = items[-1]['id']
+
+    pages = Queue(maxsize=readahead)
+    stop = threading.Event()
+
+    def put(page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def reader(previd):
+        try:
+            while not stop.is_set():
+                items = getitems(subreddit, previd, sort)
+                put(items)
+                if not items:
+                    return
+                previd = items[-1]['id']
+        # Hand errors (ListingError above all) to the consumer.
+        except BaseException as ERROR:
+            put(ERROR)
+
+    thread = threading.Thread(target=reader, args=(previd,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            page = pages.get()
+            if isinstance(page, BaseException):
+                raise page
+            if not page:
+                return
+            yield page
+    finally:
+        stop.set()
+        try:
+            pages.get_nowait()
+        except Empty:
+            pass
+
 
 if __name__ == "__main__":
 
@@ -2,22 +2,48 @@
 """Download images from a reddit.com subreddit."""
 
 import re
-import io
+import sys
+import codecs
 import logging
 import time
 import urllib.request, urllib.parse, urllib.error
 import string
-import requests
-from urllib.request import urlopen
+import threading
+import hashlib
+import heapq
+import itertools
+import json
+from collections import namedtuple
 from urllib.error import HTTPError, URLError
 from http.client import InvalidURL
 from argparse import ArgumentParser
 from os.path import exists as pathexists, join as pathjoin, basename as pathbasename, splitext as pathsplitext, split as pathsplit
-from os import mkdir
-from reddit import getitems
+from os.path import getsize, abspath, lexists
+from os import mkdir, makedirs, replace, link, symlink, remove
+from reddit import getitems, getlisting, iterpages, Post, ListingError
 from html.parser import HTMLParser
 from gfycatupdloader import gfycat
 import imgrush
+import httpsession
+from httpsession import urlopen
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import phash
+import imagesize
+import metrics
+from resolvecache import ResolverCache, CACHE_NAME, DEFAULT_TTL, DEFAULT_NEGATIVE_TTL, DEFAULT_MAX_ENTRIES
+from downloadindex import DownloadIndex, INDEX_NAME
+from layout import Layout, sanitize, NAME_MAX
+import postprocess
+import backfill
+from journal import Journal, JOURNAL_NAME
+from speculate import Speculator
+import variants
+import manifest
+from manifest import ManifestWriter
+from variants import gfycat_variants, imgrush_variants
+from throttle import Bandwidth, HostLimiter, HostUnavailableError, parse_host_limits, backoff_delay
+from throttle import DEFAULT_HOST_DELAY, DEFAULT_HOST_LIMIT, DEFAULT_HOST_BURST, DEFAULT_RETRIES
 
 # Used to extract src from Deviantart URLs
 class DeviantHTMLParser(HTMLParser):
@@ -50,6 +76,56 @@ class DeviantHTMLParser(HTMLParser):
                         return
 
 
+# Size of the chunks downloads are streamed to disk in.
+CHUNK_SIZE = 64 * 1024
+
+_BUFFERS = threading.local()
+
+# Size of the reads when scanning a web page for links.
+PAGE_CHUNK = 16 * 1024
+
+# Most bytes read from the start of a download to find the image size.
+SNIFF_LIMIT = 64 * 1024
+
+# Size of the reads while looking for the image size.
+SNIFF_CHUNK = 4096
+
+# Most imgrush hashes prefetch_imgrush looks up in one API call.
+IMGRUSH_BATCH = 50
+
+# imgrush API answers fetched by prefetch_imgrush, keyed by hash.
+IMGRUSH_INFO = {}
+
+# Watch mode aims to find this many new posts per poll of a subreddit.
+WATCH_TARGET = 5
+
+# Resolved files that may wait for a download worker by default.
+DEFAULT_QUEUE_SIZE = 100
+
+# -priority orders: the key of a post's files in the download queue,
+# lowest first. Ties keep their listing order.
+PRIORITIES = {
+    'score': lambda item: -item['score'],
+    'new': lambda item: -(item.get('created_utc') or 0),
+    'old': lambda item: item.get('created_utc') or 0,
+    'listing': lambda item: 0,
+}
+
+# HTTP errors that mean a guessed direct URL (see speculate.py) was wrong.
+GUESS_MISSED = (404, 410)
+
+# Most listing pages a single watch mode poll reads.
+WATCH_MAX_PAGES = 10
+
+# What download_from_url stored. 'duplicate' is the path of an identical
+# file the download was linked to, 'phash' its perceptual hash and
+# 'similar' the (path, distance) of a near-duplicate found for it. 'path'
+# is None when the file was discarded as a near-duplicate. 'source' is
+# set by Downloader.fetch when the file came from another URL than the
+# one queued.
+Download = namedtuple('Download', 'path size sha256 duplicate phash similar source', defaults=(None, None, None, None))
+
+
 class WrongFileTypeException(Exception):
     """Exception raised when incorrect content-type discovered"""
 
@@ -57,39 +133,45 @@ class WrongFileTypeException(Exception):
 class FileExistsException(Exception):
     """Exception raised when file exists in specified directory"""
 
+    # The file and its URL, when Downloader.fetch found it in place of a
+    # wrongly guessed URL.
+    path = None
+    source = None
+
+
+class ResolveFailedException(Exception):
+    """Exception raised when resolving a URL is known to fail"""
+
+
+class FileFilteredException(Exception):
+    """Exception raised when a file is too small or too large to keep"""
+
 
 def extract_imgur_album_urls(album_url):
     """
     Given an imgur album URL, attempt to extract the images within that
     album
 
+    The page is scanned line by line as it arrives and the connection is
+    dropped after the first line that lists image hashes.
+
     Returns:
         List of qualified imgur URLs
     """
     album_url = urllib.parse.unquote(album_url) #.decode('utf8')
-    r = requests.get(album_url)
-    album_url = r.url
-    response = urlopen(album_url)
-    info = response.info()
-
-    # Rudimentary check to ensure the URL actually specifies an HTML file
-    if 'content-type' in info and not info['content-type'].startswith('text/html'):
-        return []
-
-    filedata = response.read()
     match = re.compile(r'\"hash\":\"(.[^\"]*)\"')
     items = []
-    filedata = filedata.decode()
-    memfile = io.StringIO(filedata)
-
-    for line in memfile.readlines():
-        results = re.findall(match, line)
-        if not results:
-            continue
+    with urlopen(album_url) as response:
+        info = response.info()
 
-        items = results
+        # Rudimentary check to ensure the URL actually specifies an HTML file
+        if 'content-type' in info and not info['content-type'].startswith('text/html'):
+            return []
 
-    memfile.close()
+        for line in iter_lines(response):
+            items = re.findall(match, line)
+            if items:
+                break
 
     urls = ['http://i.imgur.com/%s.jpg' % imghash for imghash in items]
 
@@ -118,26 +200,127 @@ def extract_gfycat_album_urls(album_url):
 
         for i in range(0,gfyurl[0].__len__()):
             gfyurls = gfyurl[0][i]
-            items += [gfyurls["webmUrl"]]
-            urls = items
+            gfyurl_chosen = variants.choose(gfycat_variants(gfyurls))
+            if gfyurl_chosen:
+                items += [gfyurl_chosen]
 
-    return urls
+    return items
+
+
+def iter_chunks(response):
+    """Yield the body of response as text, PAGE_CHUNK bytes at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        data = response.read(PAGE_CHUNK)
+        if not data:
+            break
+        yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_lines(response):
+    """Yield the lines of the body of response as they arrive."""
+    rest = ''
+    for text in iter_chunks(response):
+        lines = (rest + text).split('\n')
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def transfer_buffer():
+    """Return the calling thread's reusable download buffer."""
+    buf = getattr(_BUFFERS, 'buf', None)
+    if buf is None:
+        buf = _BUFFERS.buf = bytearray(CHUNK_SIZE)
+    return buf
+
+
+def range_start(content_range):
+    """
+    Return the first byte offset of a 'bytes START-END/TOTAL' Content-Range
+    header, or None if it can't be parsed.
+    """
+    match = re.match(r'bytes (\d+)-', content_range or '')
+    return int(match.group(1)) if match else None
+
+
+def total_size(info, offset):
+    """
+    Return the size of the whole file from the headers of a response that
+    starts at byte offset, or None if the server didn't say.
+    """
+    match = re.match(r'bytes \d+-\d+/(\d+)', info.get('content-range') or '')
+    if match:
+        return int(match.group(1))
+    length = info.get('content-length')
+    if length is not None and length.isdigit():
+        return offset + int(length)
+    return None
 
 
-def download_from_url(url, dest_file):
+def sniff_dimensions(response):
+    """
+    Read from response until the image size can be parsed from what came
+    in, at most SNIFF_LIMIT bytes.
+
+    Returns:
+        (bytes read, (width, height) or None)
+    """
+    head = bytearray()
+    size = None
+    while size is None and len(head) < SNIFF_LIMIT:
+        chunk = response.read(SNIFF_CHUNK)
+        if not chunk:
+            break
+        head += chunk
+        size = imagesize.dimensions(head)
+    return head, size
+
+
+def download_from_url(url, dest_file, domain='', min_width=0, min_height=0, max_bytes=0, bandwidth=None):
     """
     Attempt to download file specified by url to 'dest_file'
 
+    'domain' is the reddit post's domain, used to patch up the broken
+    content-types some hosts send.
+
+    With min_width or min_height set, the image size is parsed from the
+    first few KB of a JPEG, PNG, GIF or WebM body and smaller files are
+    abandoned there. Files of unknown size and resumed downloads are let
+    through. With max_bytes set, files the server says are larger are
+    rejected before any of the body is read, and a transfer that grows
+    past it is aborted. With bandwidth (a throttle.Bandwidth) given, the
+    transfer keeps within its share of the cap.
+
+    The body is streamed in chunks to 'dest_file.part', which is renamed
+    to 'dest_file' only once the transfer is complete. A '.part' file left
+    behind by an interrupted run is resumed with an HTTP Range request.
+
+    Returns:
+        a Download with the file's path, size and SHA-256 hex digest.
+
     Raises:
         WrongFileTypeException
 
             when content-type is not in the supported types or cannot
             be derived from the URL
 
+        FileFilteredException
+
+            when the file is smaller than min_width x min_height or
+            larger than max_bytes.
+
         FileExceptionsException
 
             If the filename (derived from the URL) already exists in
             the destination directory.
+
+        URLError
+
+            when the connection closes before the whole body arrived.
+            The '.part' file is kept so the next attempt can resume.
     """
     # Don't download files multiple times!
     if pathexists(dest_file):
@@ -148,14 +331,30 @@ def download_from_url(url, dest_file):
 #    r = requests.get(url)
 #    url = r.url
 
-    response = urlopen(url)
+    part_file = dest_file + '.part'
+    offset = getsize(part_file) if pathexists(part_file) else 0
+    # Ask for the body as-is so Content-Length and Range offsets refer to
+    # the bytes that end up on disk.
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+    try:
+        response = urlopen(url, headers=headers)
+    except HTTPError as ERROR:
+        # The .part file is no use to a server that can't serve the rest
+        # of it, so start over.
+        if not offset or ERROR.code != 416:
+            raise
+        offset = 0
+        del headers['Range']
+        response = urlopen(url, headers=headers)
 #    t = response.info()["content-type"]
  #   print(t)
     info = response.info() #.decode('utf8')
     # self.response.headers['Location'] = urllib.quote(absolute_url.encode("utf-8"))
 
     # Work out file type either from the response or the url.
-    if 'content-type' in list(info.keys()):
+    if 'content-type' in info:
         filetype = info['content-type']
     elif url.endswith('.jpg') or url.endswith('.jpeg'):
         filetype = 'image/jpeg'
@@ -173,17 +372,18 @@ def download_from_url(url, dest_file):
         filetype = 'unknown'
 
     # Fix broken filetype descriptors on minus.com
-    if ITEM['domain'] == 'i.minus.com' and filetype == 'image%2Fgif; charset=ISO-8859-1':
+    if domain == 'i.minus.com' and filetype == 'image%2Fgif; charset=ISO-8859-1':
         filetype = 'image/gif'
-    elif ITEM['domain'] == 'i.minus.com' and filetype == 'image%2Fjpeg; charset=ISO-8859-1':
+    elif domain == 'i.minus.com' and filetype == 'image%2Fjpeg; charset=ISO-8859-1':
         filetype = 'image/jpeg'
-    elif ITEM['domain'] == 'imgrush.com' and filetype == 'text/html; charset=utf-8':
+    elif domain == 'imgrush.com' and filetype == 'text/html; charset=utf-8':
         filetype = 'video'
-    elif 'imgur.com' in ITEM['domain'] and filetype == 'text/html; charset=utf-8':
+    elif 'imgur.com' in domain and filetype == 'text/html; charset=utf-8':
         filetype = 'video/webm'
 
     # Only try to download acceptable image types
     if not filetype in ['image/jpeg', 'image/png', 'image/gif', 'image%2Fgif', 'image%2Fjpeg', 'video/webm', 'video/mp4', 'video', 'video/gifv']:
+        response.close()
         raise WrongFileTypeException('WRONG FILE TYPE: %s has type: %s!' % (url, filetype))
 
 #    if ITEM['domain'] == 'youtu.be' or ITEM['domain'] == 'youtube.com':
@@ -192,10 +392,104 @@ def download_from_url(url, dest_file):
 #        except subprocess.CalledProcessError, e:
 #            print e.output
 
-    filedata = response.read()
-    filehandle = open(dest_file, 'wb')
-    filehandle.write(filedata)
-    filehandle.close()
+    # Servers that ignore the Range header send the whole body again.
+    if offset and (response.getcode() != 206 or range_start(info.get('content-range')) != offset):
+        offset = 0
+
+    size = total_size(info, offset)
+    if max_bytes and size is not None and size > max_bytes:
+        response.close()
+        raise FileFilteredException('TOO LARGE: %s is %d bytes.' % (url, size))
+
+    # Check the image size before anything is written.
+    head = b''
+    if not offset and (min_width or min_height):
+        head, dimensions = sniff_dimensions(response)
+        if dimensions and (dimensions[0] < min_width or dimensions[1] < min_height):
+            response.close()
+            raise FileFilteredException('TOO SMALL: %s is %dx%d.' % (url, dimensions[0], dimensions[1]))
+
+    # The SHA-256 covers the whole file, so a resumed download first
+    # hashes what is already on disk.
+    digest = hashlib.sha256()
+    buf = transfer_buffer()
+    view = memoryview(buf)
+    if offset:
+        with open(part_file, 'rb') as filehandle:
+            for count in iter(lambda: filehandle.readinto(buf), 0):
+                digest.update(view[:count])
+
+    # Time spent waiting for the network and writing to disk (including
+    # hashing) is added up separately for the metrics.
+    expected = info.get('content-length')
+    received = len(head)
+    transfer_time = write_time = throttled = 0.0
+    if bandwidth is not None:
+        throttled += bandwidth.take(received)
+    with response, open(part_file, 'ab' if offset else 'wb') as filehandle:
+        filehandle.write(head)
+        digest.update(head)
+        tick = time.perf_counter()
+        while True:
+            if max_bytes and offset + received > max_bytes:
+                break
+            count = response.readinto(buf)
+            read = time.perf_counter()
+            transfer_time += read - tick
+            if not count:
+                break
+            filehandle.write(view[:count])
+            digest.update(view[:count])
+            received += count
+            tick = time.perf_counter()
+            write_time += tick - read
+            if bandwidth is not None:
+                throttled += bandwidth.take(count)
+                tick = time.perf_counter()
+    metrics.observe('transfer', transfer_time)
+    metrics.observe('write', write_time)
+    if bandwidth is not None:
+        metrics.observe('bandwidth_wait', throttled)
+
+    if max_bytes and offset + received > max_bytes:
+        remove(part_file)
+        raise FileFilteredException('TOO LARGE: %s is over %d bytes.' % (url, max_bytes))
+    if expected is not None and expected.isdigit() and received < int(expected):
+        raise URLError('Incomplete download of %s: got %d of %s bytes.' % (url, received, expected))
+    replace(part_file, dest_file)
+    return Download(dest_file, offset + received, digest.hexdigest())
+
+
+def file_extension(url):
+    """Return the file extension of url, without any http query."""
+    fileext = pathsplitext(url)[1]
+    if '?' in fileext:
+        fileext = fileext[:fileext.index('?')]
+    return fileext
+
+
+def link_duplicate(dest_file, original, mode):
+    """
+    Replace dest_file with a hard or symbolic link (mode 'hardlink' or
+    'symlink') to original, a file with identical contents.
+
+    Returns:
+        True if the link was made, False if the filesystem refused (for
+        instance a hardlink across devices), in which case dest_file is
+        left alone.
+    """
+    temp_file = dest_file + '.link'
+    try:
+        if mode == 'symlink':
+            symlink(abspath(original), temp_file)
+        else:
+            link(original, temp_file)
+        replace(temp_file, dest_file)
+    except OSError:
+        if lexists(temp_file):
+            remove(temp_file)
+        return False
+    return True
 
 
 def process_imgur_url(url):
@@ -240,32 +534,28 @@ def process_deviant_url(url):
     if url.endswith('.jpg'):
         return [url]
     else:
-        # Get Page and parse for image link
-        response = urlopen(url)
-        filedata = response.read()
-        filedata = filedata.decode()
+        # Get Page and parse for image link, stopping as soon as the
+        # image has turned up
         parser = DeviantHTMLParser()
-        try:
-            parser.feed(filedata)
-            if parser.IMAGE != None:
-                return [parser.IMAGE]
-            return [url]
-        # Exceptions thrown when non-ascii chars are found
-        except UnicodeDecodeError as ERROR:
-            if parser.IMAGE != None:
-                return [parser.IMAGE]
-            else:
-                return[url]
+        with urlopen(url) as response:
+            for text in iter_chunks(response):
+                parser.feed(text)
+                if parser.IMAGE != None:
+                    break
+        if parser.IMAGE != None:
+            return [parser.IMAGE]
+        return [url]
     # Dont return None!
 #    return [url]
 
 def process_gfycat_url(url):
     """
     Given a gfycat URL, determine if it's a direct link to a webm/gif.
-    If not, attempt to determine the proper URL
+    If not, attempt to determine the proper URL, picking one of the
+    encodings gfycat offers with variants.choose.
 
     Returns:
-        gfycat webm URL
+        gfycat webm, mp4 or gif URL
     """
     p = re.compile('^(?:https?:\/\/[\da-z\.-]+\.[a-z\.]{2,6})\/([\w \.-]*)\/([\/\w \.-]*)')
     m = p.match(url)
@@ -274,18 +564,55 @@ def process_gfycat_url(url):
     elif 'gfycat.com' in url:
           tail = pathsplit(url)[1]
           query = gfycat().more(tail)
-          url = query.get("webmUrl")
+          url = variants.choose(gfycat_variants(query.json()))
+          if url is None:
+              raise ValueError('gfycat lists no files for %s' % tail)
     return [url]
 
+def imgrush_hash(url):
+    """Return the imgrush hash of an imgrush.com or mediacru.sh URL, or None."""
+    if 'imgrush.com' in url or 'mediacru.sh' in url:
+        return pathsplit(url)[1] or None
+    return None
+
+
+def prefetch_imgrush(urls, cache=None):
+    """
+    Look up the imgrush hashes of all the given post URLs with batched
+    imgrush.info_list calls, IMGRUSH_BATCH hashes at a time, and keep the
+    answers in IMGRUSH_INFO for process_imgrush_url. URLs the resolver
+    cache already knows are left out. Anything the batch calls miss is
+    resolved per post as before.
+    """
+    IMGRUSH_INFO.clear()
+    hashes = []
+    for url in urls:
+        imghash = imgrush_hash(url)
+        if imghash and imghash not in hashes and (cache is None or url not in cache):
+            hashes.append(imghash)
+
+    for start in range(0, len(hashes), IMGRUSH_BATCH):
+        try:
+            IMGRUSH_INFO.update(imgrush.info_list(hashes[start:start + IMGRUSH_BATCH]))
+        except (HTTPError, URLError, ValueError):
+            pass
+
+
 def process_imgrush_url(url):
 
 #    Given a imgrush URL, parse the webm link and return it for downloading.
 
     if 'imgrush.com' in url:
         tail = pathsplit(url)[1]
-        query = imgrush.info(tail)
-        files = query['files'][0]
-        url = files.get("url")
+        if tail in IMGRUSH_INFO:
+            query = IMGRUSH_INFO.pop(tail)
+            if query is None:
+                raise ValueError('imgrush has no file %s' % tail)
+        else:
+            query = imgrush.info(tail)
+        url = variants.choose(imgrush_variants(query))
+        if url is None:
+            raise ValueError('imgrush lists no files for %s' % tail)
     return[url]
 
 
@@ -300,26 +627,731 @@ def extract_urls(url):
 #    urls = []
 
     if 'imgur.com' in url:
-        urls = process_imgur_url(url)
+        with metrics.timer('resolve_imgur'):
+            urls = process_imgur_url(url)
     elif 'deviantart.com' in url:
-        urls = process_deviant_url(url)
+        with metrics.timer('resolve_deviantart'):
+            urls = process_deviant_url(url)
     elif 'gfycat.com' in url:
-        urls = process_gfycat_url(url)
+        with metrics.timer('resolve_gfycat'):
+            urls = process_gfycat_url(url)
     elif 'mediacru.sh' in url:
         url = url.replace('mediacru.sh','imgrush.com')
-        urls = process_imgrush_url(url)
+        with metrics.timer('resolve_imgrush'):
+            urls = process_imgrush_url(url)
     elif 'imgrush.com' in url:
-        urls = process_imgrush_url(url)
+        with metrics.timer('resolve_imgrush'):
+            urls = process_imgrush_url(url)
     else:
         urls = [url]
 
     return urls
 
 
+# Post URLs that extract_urls needs network requests to resolve.
+RESOLVED_URLS = ('imgur.com/a/', 'imgur.com/gallery/', 'deviantart.com', 'gfycat.com', 'mediacru.sh', 'imgrush.com')
+
+
+def resolve_urls(url, cache=None):
+    """
+    Return extract_urls(url), going through cache (a ResolverCache) for
+    the URLs that take network round-trips to resolve.
+
+    Resolutions that fail with a client error (HTTP 4xx or a bad API
+    answer) are cached as failures; network trouble is not.
+
+    Raises:
+        ResolveFailedException
+
+            when resolving url failed recently and that is cached, or
+            the host gave an answer it can't be resolved from.
+    """
+    if cache is None or not any(part in url for part in RESOLVED_URLS):
+        try:
+            return extract_urls(url)
+        except (ValueError, KeyError, IndexError) as ERROR:
+            raise ResolveFailedException('Bad answer: %r' % ERROR)
+
+    cached = cache.get(url)
+    if cached is not None:
+        urls, error = cached
+        if urls is None:
+            raise ResolveFailedException('%s (cached)' % error)
+        return urls
+
+    try:
+        urls = extract_urls(url)
+    except HTTPError as ERROR:
+        if ERROR.code < 500:
+            cache.put_failure(url, 'HTTP ERROR: Code %s' % ERROR.code)
+        raise
+    except (ValueError, KeyError, IndexError) as ERROR:
+        cache.put_failure(url, 'Bad answer: %r' % ERROR)
+        raise ResolveFailedException('Bad answer: %r' % ERROR)
+    cache.put(url, urls)
+    return urls
+
+
+class Job(object):
+    """
+    One subreddit to crawl, with its own filters, destination directory,
+    listing position and counters.
+    """
+
+    # Settings a job file entry may give, and where they come from.
+    SETTINGS = ('reddit', 'dir', 'last', 'score', 'num', 'update', 'sfw', 'nsfw', 'regex')
+
+    # The type each setting must have in a job file.
+    SETTING_TYPES = {'reddit': str, 'dir': str, 'last': str, 'score': int, 'num': int,
+                     'update': bool, 'sfw': bool, 'nsfw': bool, 'regex': str}
+
+    def __init__(self, reddit, dir, last='', score=0, num=0, update=False, sfw=False, nsfw=False, regex=None, sort=None):
+        self.reddit = reddit
+        self.dir = dir
+        self.last = last
+        self.score = score
+        self.num = num
+        self.update = update
+        self.sfw = sfw
+        self.nsfw = nsfw
+        self.regex = regex
+        # If a regex has been specified, compile the rule (once)
+        self.re_rule = re.compile(regex) if regex else None
+        self.sort = sort
+        self.stats = Counter()
+        self.pending = 0
+        self.finished = False
+        self.pages = None
+        # Watch mode: the newest post seen (as a number), the listing's
+        # cache validators and the polling schedule.
+        self.newest = 0
+        self.etag = self.modified = None
+        self.rate = None
+        self.interval = 0
+        self.polled = self.next_poll = 0
+
+    def skip_reason(self, item):
+        """Return why item is filtered out of this job, or None to keep it."""
+        if item['score'] < self.score:
+            return 'SCORE: %s has score of %s which is lower than required score of %s.' % (item['id'], item['score'], self.score)
+        elif self.sfw and item['over_18']:
+            return 'NSFW: %s is marked as NSFW.' % (item['id'])
+        elif self.nsfw and not item['over_18']:
+            return 'Not NSFW, skipping %s' % (item['id'])
+        elif self.re_rule and not re.match(self.re_rule, item['title']):
+            return 'Regex match failed'
+        return None
+
+    def schedule(self, new_posts, polled, min_interval, max_interval):
+        """
+        Plan this job's next poll after one started at time polled found
+        new_posts posts. The interval aims at about WATCH_TARGET new posts
+        per poll, using a running average of the post rate, within
+        min_interval and max_interval seconds.
+        """
+        rate = new_posts / max(polled - self.polled, 1.0)
+        self.rate = rate if self.rate is None else (self.rate + rate) / 2
+        interval = WATCH_TARGET / self.rate if self.rate > 0 else max_interval
+        self.interval = min(max(interval, min_interval), max_interval)
+        self.polled = polled
+        self.next_poll = polled + self.interval
+
+    def has_enough(self):
+        """True once this job's downloads (including ones in flight) reach -num."""
+        return 0 < self.num <= self.stats['downloaded'] + self.pending
+
+
+def job_defaults(args):
+    """Return the Job settings the command line gives every job."""
+    return dict(last=args.last, score=args.score, num=args.num, update=args.update,
+                sfw=args.sfw, nsfw=args.nsfw, regex=args.regex)
+
+
+def load_jobs(args):
+    """
+    Build the list of Jobs to run from the command line.
+
+    <subreddit> may name several subreddits separated by commas, and
+    -jobs names a JSON file holding a list of objects with any of the
+    keys in Job.SETTINGS. Settings a job doesn't give come from the
+    command line. With more than one job each one downloads into its own
+    folder under <dest_file> unless it names a 'dir'.
+
+    Raises:
+        ValueError when the job file is malformed.
+    """
+    defaults = job_defaults(args)
+    entries = [{'reddit': name} for name in (args.reddit or '').split(',') if name]
+    if args.jobs:
+        with open(args.jobs) as jobfile:
+            listed = json.load(jobfile)
+        if not isinstance(listed, list):
+            raise ValueError('%s must hold a list of jobs.' % args.jobs)
+        for entry in listed:
+            if not isinstance(entry, dict) or not entry.get('reddit'):
+                raise ValueError('Every job in %s needs a "reddit" name.' % args.jobs)
+            unknown = set(entry) - set(Job.SETTINGS)
+            if unknown:
+                raise ValueError('Unknown job settings in %s: %s' % (args.jobs, ', '.join(sorted(unknown))))
+            for name, value in entry.items():
+                kind = Job.SETTING_TYPES[name]
+                if kind is int and isinstance(value, str) and value.strip().lstrip('-').isdigit():
+                    # Numbers given as strings ("50") are taken as numbers.
+                    entry[name] = int(value)
+                elif not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+                    raise ValueError('"%s" of job "%s" in %s must be a %s, not %r.'
+                                     % (name, entry['reddit'], args.jobs, kind.__name__, value))
+            entries.append(entry)
+
+    jobs = []
+    for entry in entries:
+        settings = dict(defaults)
+        settings.update(entry)
+        if 'dir' in entry:
+            settings['dir'] = pathjoin(args.dir, entry['dir'])
+        elif len(entries) > 1:
+            settings['dir'] = pathjoin(args.dir, entry['reddit'])
+        else:
+            settings['dir'] = args.dir
+        jobs.append(Job(**settings))
+    return jobs
+
+
+def write_reports(args, jobs, speculator=None):
+    """Write the -report and -prometheus files, if asked for."""
+    posts = {job.reddit: job.stats for job in jobs}
+    if args.report:
+        metrics.write_json(args.report, posts={name: dict(stats) for name, stats in posts.items()},
+                           speculation=speculator.summary() if speculator is not None else {})
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus, posts)
+
+
+def poll_job(job):
+    """
+    Return the posts in job's subreddit that are newer than the newest one
+    it has seen, newest first. The first 'new' page is requested
+    conditionally; when all of a page is new the next one is read too, up
+    to WATCH_MAX_PAGES.
+    """
+    items, job.etag, job.modified = getlisting(job.reddit, sort='new', etag=job.etag, modified=job.modified)
+    fresh = []
+    for page in range(WATCH_MAX_PAGES):
+        if not items:
+            break
+        new = [item for item in items if int(item['id'], 36) > job.newest]
+        fresh.extend(new)
+        if len(new) < len(items):
+            break
+        items = getitems(job.reddit, items[-1]['id'], 'new')
+    return fresh
+
+
+def watch_jobs(jobs, downloader, min_interval, max_interval):
+    """
+    Keep polling the jobs' subreddits for new posts, each on its own
+    adaptive schedule (see Job.schedule), and queue whatever turns up.
+    Finished downloads are collected while waiting for the next poll.
+    The -report and -prometheus files are rewritten after every poll.
+    A poll that fails is tried again later, the interval doubling while
+    it keeps failing. Runs until interrupted or every job has reached its -num.
+    """
+    now = time.time()
+    for job in jobs:
+        job.polled = now
+        job.next_poll = now + min_interval
+    while True:
+        watching = [job for job in jobs if not job.has_enough()]
+        if not watching:
+            return
+        job = min(watching, key=lambda job: job.next_poll)
+        delay = job.next_poll - time.time()
+        while delay > 0:
+            if downloader.pending:
+                downloader.collect(delay)
+            else:
+                time.sleep(delay)
+            delay = job.next_poll - time.time()
+
+        polled = time.time()
+        try:
+            items = poll_job(job)
+        except ListingError as ERROR:
+            # Try again later, backing off while reddit stays unreachable.
+            job.interval = min(max(job.interval * 2, min_interval), max_interval)
+            job.next_poll = polled + job.interval
+            print('    %s Polling "%s" again in %d seconds.' % (ERROR, job.reddit, job.interval))
+            downloader.logger.debug('    %s Polling "%s" again in %d seconds.' % (ERROR, job.reddit, job.interval))
+            continue
+        if items:
+            print('    %d new posts in "%s".' % (len(items), job.reddit))
+            job.finished = False
+            downloader.queue_items(job, items)
+        job.schedule(len(items), polled, min_interval, max_interval)
+        write_reports(downloader.args, jobs, downloader.speculator)
+
+
+class Downloader(object):
+    """
+    Resolves the posts of running jobs and hands their files to a pool of
+    download workers, tallying each outcome into its job's counters and
+    recording it in the download index.
+    """
+
+    def __init__(self, args, index, cache, phashes, limiter, bandwidth, layout, postprocessor, journal, logger,
+                 manifest=None):
+        self.args = args
+        self.index = index
+        self.cache = cache
+        self.phashes = phashes
+        self.limiter = limiter
+        self.bandwidth = bandwidth
+        self.layout = layout
+        self.postprocessor = postprocessor
+        self.journal = journal
+        self.logger = logger
+        self.manifest = manifest
+        self.pool = ThreadPoolExecutor(max_workers=args.workers)
+        # Maps each download future to its (url, file path, post id, job).
+        self.pending = {}
+        # Downloads waiting for a worker, as a heap of (priority, sequence
+        # number, url, file path, post id, domain, guessed from, job), best
+        # first.
+        self.queue = []
+        self._sequence = itertools.count()
+        self._priority = PRIORITIES[args.priority]
+        # A guessed gfycat URL is the webm, which only -variant webm would
+        # pick without sizes to compare. A -resolve manifest only gets
+        # checked URLs: whatever downloads from it may not be able to fall
+        # back.
+        self.speculator = None
+        if not (args.no_speculate or args.resolve or args.max_bytes) and args.variant == 'webm':
+            self.speculator = Speculator()
+
+    def transfer(self, url, dest_file, domain):
+        """
+        Download url to dest_file (see download_from_url) while holding one
+        of the transfer slots for the url's host, applying the -min-width,
+        -min-height and -max-bytes filters. A transfer that breaks off is
+        resumed up to -retries times.
+        """
+        args = self.args
+        host = urllib.parse.urlparse(url).hostname or domain
+        queued = time.perf_counter()
+        with self.limiter.slot(host):
+            metrics.observe('host_wait', time.perf_counter() - queued)
+            attempt = 0
+            while True:
+                try:
+                    with metrics.timer('download'):
+                        return download_from_url(url, dest_file, domain, args.min_width, args.min_height, args.max_bytes,
+                                                 self.bandwidth)
+                except (HTTPError, HostUnavailableError):
+                    # Already retried as far as it makes sense.
+                    raise
+                except URLError as ERROR:
+                    # The connection broke off; try again from where the
+                    # .part file ends.
+                    if attempt >= args.retries:
+                        raise
+                    metrics.count_error('retry', ERROR)
+                    time.sleep(backoff_delay(attempt))
+                    attempt += 1
+
+    def fetch(self, url, dest_file, domain, guessed_from=None):
+        """
+        Download url to dest_file with transfer.
+
+        When url is a guess (see speculate.py) for the post link
+        guessed_from and it turns out wrong, the link is resolved after all
+        and the file it leads to is downloaded instead, with the extension
+        of dest_file changed to match. The Download's source is then the
+        URL actually used.
+
+        With -dedup, when the index already holds a file with the same
+        contents dest_file is replaced by a link to it.
+
+        With -similar, images are checked for near-duplicates at most that
+        many bits away. With -similar-action 'skip' such a file is deleted
+        again, with 'flag' it is kept.
+
+        Returns:
+            the Download from download_from_url.
+
+        Raises:
+            ResolveFailedException when a wrong guess's link can't be
+            resolved either.
+        """
+        args = self.args
+        try:
+            result = self.transfer(url, dest_file, domain)
+        except (HTTPError, WrongFileTypeException) as ERROR:
+            if guessed_from is None or (isinstance(ERROR, HTTPError) and ERROR.code not in GUESS_MISSED):
+                raise
+            if self.speculator is not None:
+                self.speculator.record(guessed_from, False)
+            try:
+                url = resolve_urls(guessed_from, self.cache)[0]
+            except (ValueError, KeyError, IndexError) as ERROR:
+                raise ResolveFailedException('Bad answer: %r' % ERROR)
+            dest_file = pathsplitext(dest_file)[0] + file_extension(url)
+            try:
+                result = self.transfer(url, dest_file, domain)._replace(source=url)
+            except FileExistsException as ERROR:
+                ERROR.path, ERROR.source = dest_file, url
+                raise
+        else:
+            if guessed_from is not None:
+                if self.speculator is not None:
+                    self.speculator.record(guessed_from, True)
+                if self.cache is not None:
+                    self.cache.put(guessed_from, [url])
+        if args.dedup:
+            original = self.index.find_hash(result.sha256, result.size, pathsplitext(dest_file)[1])
+            if original and original != abspath(dest_file) and link_duplicate(dest_file, original, args.dedup):
+                result = result._replace(duplicate=original)
+        if self.phashes is not None and not result.duplicate:
+            with metrics.timer('phash'):
+                value = phash.dhash(dest_file)
+            if value is not None:
+                match = self.phashes.match_or_add(value, abspath(dest_file), args.similar)
+                result = result._replace(phash=value, similar=match)
+                if match and args.similar_action == 'skip':
+                    remove(dest_file)
+                    result = result._replace(path=None)
+        return result
+
+    def queue_items(self, job, items, resolved=None, resumed=False, guessed=()):
+        """
+        Filter and resolve a page of job's posts and queue their files for
+        download, waiting for room in the queue as needed. Stops early once
+        the job is finished by -num or -update.
+
+        Up to -queue-size files wait in the queue, and workers take them
+        in -priority order (highest score first by default), so with
+        -bandwidth limiting the run the best posts arrive first.
+
+        Links that follow a known pattern (see speculate.py) aren't
+        resolved: the direct URL they are guessed to lead to is queued
+        instead, and fetch falls back to resolving the link if the guess
+        is wrong.
+
+        resolved maps the ids of posts already resolved (read from a
+        manifest, or resumed from the journal) to the URLs to download,
+        None for posts that still need resolving. guessed holds the ids of
+        those whose URLs the journal recorded as a guess.
+
+        Each step is written to the journal. Posts resumed from it come
+        with resumed set; they aren't journaled again, nor counted again
+        once resolved.
+
+        With -resolve the posts' URLs are written to the manifest instead
+        of being downloaded.
+        """
+        args = self.args
+        logger = self.logger
+        journal = self.journal
+
+        if journal is not None and not resumed:
+            newest = max([job.newest] + [int(item['id'], 36) for item in items])
+            journal.page(job.reddit, [item.as_dict() for item in items], items[-1]['id'], newest, job.stats)
+
+        # Resolve all imgrush posts on the page in one go.
+        prefetch_imgrush([item['url'] for item in items if not (resolved and resolved.get(item['id']))], self.cache)
+
+        for item in items:
+            if job.finished:
+                break
+            job.last = item['id']
+            job.newest = max(job.newest, int(item['id'], 36))
+            if not (resumed and resolved.get(item['id'])):
+                job.stats['total'] += 1
+            identifier = sanitize(item['title'])
+            directory = None
+
+            reason = job.skip_reason(item)
+            if reason:
+                if args.verbose:
+                    print('    %s' % (reason))
+
+                job.stats['skipped'] += 1
+                if journal is not None:
+                    journal.skipped(item['id'], job.stats)
+                continue
+
+            urls = resolved and resolved.get(item['id'])
+            # A guess (possibly resumed from the journal) can still be
+            # wrong; fetch then needs the post link to resolve.
+            guessed_from = item['url'] if urls is not None and item['id'] in guessed else None
+            try:
+                if urls is None:
+                    guess = None
+                    if self.speculator is not None and (self.cache is None or item['url'] not in self.cache):
+                        guess = self.speculator.guess(item['url'])
+                    urls = [guess] if guess else resolve_urls(item['url'], self.cache)
+                    if guess:
+                        guessed_from = item['url']
+                    if journal is not None:
+                        journal.resolved(item['id'], urls, job.stats, guessed=bool(guess))
+            except HTTPError as ERROR:
+                print('    HTTP ERROR: Code %s. ID = %s.' % (ERROR.code, item['id']))
+                logger.debug('    HTTP ERROR: Code %s. ID = %s.' % (ERROR.code, item['id']))
+                job.stats['failed'] += 1
+            except URLError as ERROR:
+                print('    URL ERROR: %s. ID = %s.' % (item['url'], item['id']))
+                logger.debug('    URL ERROR: %s. ID = %s.' % (item['url'], item['id']))
+                job.stats['failed'] += 1
+            except ResolveFailedException as ERROR:
+                print('    RESOLVE FAILED: %s. ID = %s.' % (ERROR, item['id']))
+                logger.debug('    RESOLVE FAILED: %s. ID = %s.' % (ERROR, item['id']))
+                job.stats['failed'] += 1
+            if urls is None:
+                if journal is not None:
+                    journal.skipped(item['id'], job.stats)
+                continue
+            if self.manifest is not None:
+                # Posts whose files were all downloaded (or passed over)
+                # before aren't written again, and -update stops at them as
+                # it does when downloading.
+                seen = [row['status'] for row in (self.index.lookup(item['id'], url) for url in urls)
+                        if row and row['status'] in ('done', 'wrongtype', 'similar')]
+                if job.update and ('done' in seen or 'similar' in seen):
+                    job.finished = True
+                if urls and len(seen) == len(urls):
+                    print('    Post [%s] already downloaded.' % (item['id']))
+                    logger.debug('    Post [%s] already downloaded.' % (item['id']))
+                    job.stats['exists'] += seen.count('done')
+                    job.stats['similar'] += seen.count('similar')
+                    job.stats['skipped'] += len(seen) - seen.count('done')
+                    continue
+                self.manifest.write(item, urls)
+                job.stats['resolved'] += 1
+                if 0 < job.num <= job.stats['resolved']:
+                    job.finished = True
+                continue
+            for filecount, url in enumerate(urls):
+                fileext = file_extension(url)
+
+                # Only append numbers if more than one file.
+                filenum = ('_%d' % filecount if len(urls) > 1 else '')
+
+                # Don't download files multiple times!
+                row = self.index.lookup(item['id'], url)
+                if row and row['status'] == 'done':
+                    print('    URL [%s] already downloaded.' % (url))
+                    logger.debug('    URL [%s] already downloaded.' % (url))
+                    job.stats['exists'] += 1
+                    if journal is not None:
+                        journal.done(item['id'], url, row['status'], job.stats)
+                    if job.update:
+                        job.finished = True
+                        break
+                    continue
+                elif row and row['status'] == 'wrongtype':
+                    if args.verbose:
+                        print('    WRONG FILE TYPE: %s (cached).' % (url))
+                    job.stats['skipped'] += 1
+                    if journal is not None:
+                        journal.done(item['id'], url, row['status'], job.stats)
+                    continue
+                elif row and row['status'] == 'similar':
+                    # Discarded by -similar before; it was seen, so -update
+                    # stops here as at a file that exists.
+                    if args.verbose:
+                        print('    SIMILAR: %s (cached).' % (url))
+                    job.stats['similar'] += 1
+                    job.stats['skipped'] += 1
+                    if journal is not None:
+                        journal.done(item['id'], url, row['status'], job.stats)
+                    if job.update:
+                        job.finished = True
+                        break
+                    continue
+
+                # Wait for room in the queue. Queued and running downloads
+                # also count towards -num so that it is never overshot.
+                while self.pending and (len(self.queue) >= args.queue_size or (job.pending and job.has_enough())):
+                    self.collect()
+                if job.has_enough():
+                    job.finished = True
+                if job.finished:
+                    break
+
+                if directory is None:
+                    directory = self.layout.directory(job.dir, item)
+                filepath = pathjoin(directory, self.layout.filename(item['id'], identifier, filenum, fileext))
+                heapq.heappush(self.queue, (self._priority(item), next(self._sequence), url, filepath,
+                                            item['id'], item['domain'], guessed_from, job))
+                job.pending += 1
+                if journal is not None:
+                    journal.downloading(item['id'], url)
+                self.dispatch()
+
+        if journal is not None:
+            journal.progress(job.reddit, job.newest, job.stats)
+
+    def dispatch(self):
+        """Hand the best queued downloads to the workers that are free."""
+        while self.queue and len(self.pending) < self.args.workers:
+            _, _, url, filepath, item_id, domain, guessed_from, job = heapq.heappop(self.queue)
+            future = self.pool.submit(self.fetch, url, filepath, domain, guessed_from)
+            self.pending[future] = (url, filepath, item_id, job)
+
+    def collect(self, timeout=None):
+        """
+        Wait until at least one pending download has finished (or timeout
+        seconds have passed) and report the outcome of every finished one.
+        A job running with -update is finished by the first file that
+        already existed.
+        """
+        done, _ = wait(list(self.pending), timeout, return_when=FIRST_COMPLETED)
+        jobs = set()
+        # Finished files, as (path, key) for the post-processor.
+        processing = []
+        for future in done:
+            url, filepath, item_id, job = self.pending.pop(future)
+            jobs.add(job)
+            job.pending -= 1
+            stats = job.stats
+            subreddit = job.reddit
+            filename = pathbasename(filepath)
+            source = url
+            status = 'failed'
+            result = None
+            try:
+                result = future.result()
+            except WrongFileTypeException as ERROR:
+                print('    %s' % (ERROR))
+                self.logger.debug('    %s' % (ERROR))
+                stats['skipped'] += 1
+                status = 'wrongtype'
+            except FileFilteredException as ERROR:
+                if self.args.verbose:
+                    print('    %s' % (ERROR))
+                self.logger.debug('    %s' % (ERROR))
+                stats['filtered'] += 1
+                stats['skipped'] += 1
+                status = 'filtered'
+            except FileExistsException as ERROR:
+                print('    %s' % (ERROR))
+                self.logger.debug('    %s' % (ERROR))
+                if ERROR.source:
+                    source, filepath = ERROR.source, ERROR.path
+                stats['exists'] += 1
+                if job.update:
+                    job.finished = True
+                status = 'done'
+            except HTTPError as ERROR:
+                print('    HTTP ERROR: Code %s for %s. ID = %s' % (ERROR.code, url, item_id))
+                self.logger.debug('    HTTP ERROR: Code %s for %s. ID = %s' % (ERROR.code, url, item_id))
+                stats['failed'] += 1
+            except URLError as ERROR:
+                print('    URL ERROR: %s!' % (url))
+                self.logger.debug('    URL ERROR: %s!' % (url))
+                stats['failed'] += 1
+            except InvalidURL as ERROR:
+                print('    Invalid URL: %s!' % (url))
+                self.logger.debug('    Invalid URL: %s!' % (url))
+                stats['failed'] += 1
+            except ResolveFailedException as ERROR:
+                print('    RESOLVE FAILED: %s. ID = %s.' % (ERROR, item_id))
+                self.logger.debug('    RESOLVE FAILED: %s. ID = %s.' % (ERROR, item_id))
+                stats['failed'] += 1
+            else:
+                if result.source:
+                    # The guessed URL was wrong; the file came from the
+                    # resolved link, and its extension may differ.
+                    source = result.source
+                    if result.path:
+                        filepath = result.path
+                        filename = pathbasename(filepath)
+                if result.similar and result.path is None:
+                    print('    SIMILAR: [%s] is %d bits from [%s], discarded.' % (source, result.similar[1], result.similar[0]))
+                    self.logger.debug('    SIMILAR: [%s] is %d bits from [%s], discarded.' % (source, result.similar[1], result.similar[0]))
+                    stats['similar'] += 1
+                    stats['skipped'] += 1
+                    self.index.record(item_id, source, 'similar', None, result.size, result.sha256, subreddit, result.phash)
+                    if self.journal is not None:
+                        self.journal.done(item_id, url, 'similar', job.stats)
+                    continue
+                # Image downloaded successfully!
+                print('    Downloaded URL [%s] as [%s].' % (source, filename))
+                self.logger.debug('    Downloaded URL [%s] as [%s].' % (source, filename))
+                if result.duplicate:
+                    print('    Linked [%s] to identical [%s].' % (filename, result.duplicate))
+                    self.logger.debug('    Linked [%s] to identical [%s].' % (filename, result.duplicate))
+                    stats['linked'] += 1
+                if result.similar:
+                    print('    SIMILAR: [%s] is %d bits from [%s].' % (filename, result.similar[1], result.similar[0]))
+                    self.logger.debug('    SIMILAR: [%s] is %d bits from [%s].' % (filename, result.similar[1], result.similar[0]))
+                    stats['similar'] += 1
+                stats['downloaded'] += 1
+                status = 'done'
+
+            if result is not None:
+                self.index.record(item_id, source, status, filepath, result.size, result.sha256, subreddit, result.phash)
+                if self.postprocessor is not None and not result.duplicate:
+                    processing.append((filepath, (item_id, source, job, result)))
+            elif status == 'done':
+                self.index.record(item_id, source, status, filepath, getsize(filepath), subreddit=subreddit)
+            else:
+                self.index.record(item_id, source, status, subreddit=subreddit)
+            if self.journal is not None:
+                self.journal.done(item_id, url, status, job.stats)
+
+        if self.journal is not None:
+            for job in jobs:
+                self.journal.progress(job.reddit, job.newest, job.stats)
+        # Give the free workers their next downloads before submit may
+        # wait for room in the post-processing pool.
+        self.dispatch()
+
+        if self.postprocessor is not None:
+            for filepath, key in processing:
+                self.postprocessor.submit(filepath, key)
+            self.postprocessed(self.postprocessor.results())
+
+    def postprocessed(self, results):
+        """
+        Report the outcome of files the post-processing stage has
+        finished with, and record the new path of converted files.
+        """
+        for (item_id, url, job, result), processed, error in results:
+            if error is not None:
+                print('    POST-PROCESSING FAILED: %s: %s' % (result.path, error))
+                self.logger.debug('    POST-PROCESSING FAILED: %s: %s' % (result.path, error))
+                metrics.count_error('postprocess', error)
+                continue
+            metrics.observe('postprocess', processed.seconds)
+            job.stats['processed'] += 1
+            if processed.path != result.path:
+                # The index keeps the hash and size of the file as
+                # downloaded, so later copies of it are still recognised.
+                self.index.record(item_id, url, 'done', processed.path, result.size,
+                                  result.sha256, job.reddit, result.phash)
+            if self.args.verbose:
+                print('    Post-processed [%s].' % (pathbasename(processed.path)))
+            self.logger.debug('    Post-processed [%s].' % (pathbasename(processed.path)))
+
+    def close(self, cancel=False):
+        """
+        Let the downloads still in flight finish and stop the workers. The
+        queued ones are downloaded too, unless cancel is set; then they are
+        left in the journal for the next run.
+        """
+        if cancel:
+            self.queue = []
+        while self.pending:
+            self.collect()
+        self.pool.shutdown()
+        if self.postprocessor is not None:
+            self.postprocessed(self.postprocessor.close())
+
+
 if __name__ == "__main__":
     PARSER = ArgumentParser(description='Downloads files with specified extension from the specified subreddit.')
-    PARSER.add_argument('reddit', metavar='<subreddit>', help='Subreddit name.')
-    PARSER.add_argument('dir', metavar='<dest_file>', help='Dir to put downloaded files in.')
+    PARSER.add_argument('reddit', metavar='<subreddit>', nargs='?', help='Subreddit name, or several separated by commas.')
+    PARSER.add_argument('dir', metavar='<dest_file>', nargs='?', help='Dir to put downloaded files in.')
     PARSER.add_argument('-last', metavar='l', default='', required=False, help='ID of the last downloaded file.')
     PARSER.add_argument('-score', metavar='s', default=0, type=int, required=False, help='Minimum score of images to download.')
     PARSER.add_argument('-num', metavar='n', default=0, type=int, required=False, help='Number of images to download.')
@@ -327,8 +1359,122 @@ if __name__ == "__main__":
     PARSER.add_argument('-sfw', default=False, action='store_true', required=False, help='Download safe for work images only.')
     PARSER.add_argument('-nsfw', default=False, action='store_true', required=False, help='Download NSFW images only.')
     PARSER.add_argument('-regex', default=None, action='store', required=False, help='Use Python regex to filter based on title.')
+    PARSER.add_argument('-jobs', metavar='FILE', default=None, required=False, help='JSON file listing subreddits to download, with their own settings.')
     PARSER.add_argument('-verbose', default=False, action='store_true', required=False, help='Enable verbose output.')
+    PARSER.add_argument('-workers', metavar='N', default=1, type=int, required=False, help='Number of parallel downloads.')
+    PARSER.add_argument('-host-limit', metavar='HOST=N', default=[], action='append', required=False, help='Maximum parallel downloads from HOST (repeatable).')
+    PARSER.add_argument('-host-delay', metavar='SECONDS', default=DEFAULT_HOST_DELAY, type=float, required=False, help='Average delay between requests to the same host.')
+    PARSER.add_argument('-host-burst', metavar='N', default=DEFAULT_HOST_BURST, type=int, required=False, help='Requests to a host that may go out back to back.')
+    PARSER.add_argument('-retries', metavar='N', default=DEFAULT_RETRIES, type=int, required=False, help='Times to retry a failed request or download.')
+    PARSER.add_argument('-bandwidth', metavar='BYTES', default=0, type=int, required=False, help='Cap on the bytes per second of all downloads together.')
+    PARSER.add_argument('-priority', choices=sorted(PRIORITIES), default='score', required=False, help='Order in which queued files are downloaded (default: highest score first).')
+    PARSER.add_argument('-queue-size', metavar='N', default=DEFAULT_QUEUE_SIZE, type=int, required=False, help='Resolved files that may wait for a worker, to pick the best of.')
+    PARSER.add_argument('-readahead', metavar='N', default=1, type=int, required=False, help='Listing pages to fetch ahead of the one being downloaded.')
+    PARSER.add_argument('-watch', default=False, action='store_true', required=False, help='Keep running and download new posts as they appear.')
+    PARSER.add_argument('-watch-min', metavar='SECONDS', default=30, type=float, required=False, help='Shortest time between polls of a subreddit in -watch mode.')
+    PARSER.add_argument('-watch-max', metavar='SECONDS', default=1800, type=float, required=False, help='Longest time between polls of a subreddit in -watch mode.')
+    PARSER.add_argument('-backfill', metavar='START[:END]', default=None, required=False, help='Download every post created from START to END (dates as YYYY-MM-DD or UNIX times, END defaults to now) instead of reading the listing.')
+    PARSER.add_argument('-backfill-window', metavar='DAYS', default=backfill.DEFAULT_WINDOW / 86400, type=float, required=False, help='Length of the time windows -backfill searches.')
+    PARSER.add_argument('-backfill-workers', metavar='N', default=backfill.DEFAULT_WORKERS, type=int, required=False, help='Time windows searched at once.')
+    PARSER.add_argument('-min-width', metavar='PIXELS', default=0, type=int, required=False, help='Skip images narrower than this.')
+    PARSER.add_argument('-min-height', metavar='PIXELS', default=0, type=int, required=False, help='Skip images shorter than this.')
+    PARSER.add_argument('-max-bytes', metavar='N', default=0, type=int, required=False, help='Skip files larger than N bytes.')
+    PARSER.add_argument('-variant', default=variants.DEFAULT_POLICY, choices=variants.POLICIES, required=False, help='Which encoding of gfycat and imgrush clips to download: the smallest file, or the given format. Encodings over -max-bytes are passed over.')
+    PARSER.add_argument('-index', metavar='FILE', default=None, required=False, help='Download index database (default: %s in <dest_file>).' % INDEX_NAME)
+    PARSER.add_argument('-dedup', default=None, choices=['hardlink', 'symlink'], required=False, help='Link files whose contents were already downloaded instead of keeping another copy.')
+    PARSER.add_argument('-similar', metavar='BITS', default=None, type=int, required=False, help='Check images for near-duplicates at most BITS of 64 apart (needs numpy and Pillow).')
+    PARSER.add_argument('-similar-action', default='skip', choices=['skip', 'flag'], required=False, help='Discard near-duplicates or only report them.')
+    PARSER.add_argument('-cache', metavar='FILE', default=None, required=False, help='Resolved URL cache database (default: %s in <dest_file>).' % CACHE_NAME)
+    PARSER.add_argument('-cache-ttl', metavar='SECONDS', default=DEFAULT_TTL, type=float, required=False, help='How long resolved URLs are cached.')
+    PARSER.add_argument('-cache-negative-ttl', metavar='SECONDS', default=DEFAULT_NEGATIVE_TTL, type=float, required=False, help='How long failed resolutions are cached.')
+    PARSER.add_argument('-cache-size', metavar='N', default=DEFAULT_MAX_ENTRIES, type=int, required=False, help='Maximum number of cached resolutions.')
+    PARSER.add_argument('-no-cache', default=False, action='store_true', required=False, help='Resolve every URL afresh.')
+    PARSER.add_argument('-no-speculate', default=False, action='store_true', required=False, help='With -variant webm, always resolve gfycat links instead of trying the likely direct URL first.')
+    PARSER.add_argument('-report', metavar='FILE', default=None, required=False, help='Write timings and counters for the run to FILE as JSON.')
+    PARSER.add_argument('-prometheus', metavar='FILE', default=None, required=False, help='Write the same numbers to FILE in the Prometheus text format.')
+    PARSER.add_argument('-layout', metavar='TEMPLATE', default='', required=False, help='Sub-folders to sort files into, e.g. "{year}/{month}" or "{shard}" (fields: subreddit, id, shard, year, month, day).')
+    PARSER.add_argument('-name-bytes', metavar='N', default=NAME_MAX, type=int, required=False, help='Longest file name, in bytes; longer titles are cut short.')
+    PARSER.add_argument('-thumbnail', metavar='PIXELS', default=0, type=int, required=False, help='Make a thumbnail of each image, at most PIXELS wide and high, in a .thumbs folder (needs Pillow).')
+    PARSER.add_argument('-strip-metadata', default=False, action='store_true', required=False, help='Remove EXIF and other metadata from JPEG and PNG files.')
+    PARSER.add_argument('-convert', choices=sorted(postprocess.CONVERT_FORMATS), default=None, required=False, help='Convert images to this format (needs Pillow).')
+    PARSER.add_argument('-post-workers', metavar='N', default=None, type=int, required=False, help='Processes for -thumbnail, -strip-metadata and -convert (default: one per CPU).')
+    PARSER.add_argument('-journal', metavar='FILE', default=None, required=False, help='Journal to resume an interrupted run from (default: .redditimagegrab-journal.jsonl in <dest_file>).')
+    PARSER.add_argument('-no-journal', default=False, action='store_true', required=False, help='Don\'t keep a journal.')
+    PARSER.add_argument('-reimport', default=False, action='store_true', required=False, help='Rescan <dest_file> for existing files into the index.')
+    PARSER.add_argument('-resolve', metavar='MANIFEST', default=None, required=False, help='List and resolve posts into a JSONL manifest (- for standard output) instead of downloading them.')
+    PARSER.add_argument('-fetch', metavar='MANIFEST', default=[], action='append', required=False, help='Download the posts in a manifest written by -resolve (- for standard input) instead of listing subreddits (repeatable).')
     ARGS = PARSER.parse_args()
+    # With -jobs or -fetch the only positional argument is the destination.
+    if (ARGS.jobs or ARGS.fetch) and ARGS.dir is None:
+        ARGS.reddit, ARGS.dir = None, ARGS.reddit
+    if ARGS.dir is None:
+        PARSER.error('a <subreddit> (or -jobs) and a <dest_file> are required')
+    if ARGS.resolve and ARGS.fetch:
+        PARSER.error('-resolve and -fetch are the two halves of a run; use one or the other')
+    if ARGS.fetch and (ARGS.watch or ARGS.backfill):
+        PARSER.error('-fetch can\'t be combined with -watch or -backfill')
+    if ARGS.fetch.count(manifest.STDIO) > 1:
+        PARSER.error('standard input can only be read once')
+    if ARGS.resolve == manifest.STDIO:
+        # Messages go to standard error so that they don't end up in the
+        # manifest.
+        MANIFEST_OUT, sys.stdout = sys.stdout, sys.stderr
+    else:
+        MANIFEST_OUT = None
+    try:
+        JOBS = load_jobs(ARGS)
+    except (OSError, ValueError, TypeError, re.error) as ERROR:
+        PARSER.error('bad jobs: %s' % (ERROR))
+    if ARGS.workers < 1:
+        PARSER.error('-workers must be at least 1')
+    if ARGS.host_burst < 1:
+        PARSER.error('-host-burst must be at least 1')
+    if ARGS.bandwidth < 0:
+        PARSER.error('-bandwidth can\'t be negative')
+    if ARGS.queue_size < 1:
+        PARSER.error('-queue-size must be at least 1')
+    if ARGS.retries < 0:
+        PARSER.error('-retries can\'t be negative')
+    if ARGS.watch:
+        if not 0 < ARGS.watch_min <= ARGS.watch_max:
+            PARSER.error('-watch-min must be positive and no more than -watch-max')
+        # The high-water mark only makes sense on the 'new' listing.
+        for JOB in JOBS:
+            JOB.sort = 'new'
+    if ARGS.similar is not None and not phash.available():
+        PARSER.error('-similar needs the numpy and Pillow packages')
+    try:
+        HOST_LIMITS = parse_host_limits(ARGS.host_limit)
+    except ValueError as ERROR:
+        PARSER.error(str(ERROR))
+    BACKFILL = None
+    if ARGS.backfill:
+        try:
+            BACKFILL = backfill.parse_range(ARGS.backfill)
+        except ValueError as ERROR:
+            PARSER.error('bad -backfill: %s' % (ERROR))
+        if ARGS.watch or ARGS.update:
+            PARSER.error('-backfill can\'t be combined with -watch or -update')
+        if ARGS.backfill_window * 86400 < backfill.MIN_WINDOW:
+            PARSER.error('-backfill-window must be at least a minute')
+        if ARGS.backfill_workers < 1:
+            PARSER.error('-backfill-workers must be at least 1')
+        # Windows count as done once their posts are queued; the journal
+        # (or the manifest) is what holds on to the queued ones.
+        if ARGS.no_journal and not ARGS.resolve:
+            PARSER.error('-backfill needs the journal; drop -no-journal')
+    if (ARGS.thumbnail or ARGS.convert) and not postprocess.available():
+        PARSER.error('-thumbnail and -convert need the Pillow package')
+    if ARGS.thumbnail < 0:
+        PARSER.error('-thumbnail can\'t be negative')
+    if ARGS.post_workers is not None and ARGS.post_workers < 1:
+        PARSER.error('-post-workers must be at least 1')
+    if ARGS.name_bytes < 64:
+        PARSER.error('-name-bytes must be at least 64')
+    try:
+        LAYOUT = Layout(ARGS.layout, ARGS.name_bytes)
+    except ValueError as ERROR:
+        PARSER.error(str(ERROR))
 
 # Debug logging
     logger = logging.getLogger('red_up')
@@ -346,123 +1492,183 @@ if __name__ == "__main__":
     logger.addHandler(fh)
 
     logger.debug('')
-    print('Downloading images from "%s" subreddit' % (ARGS.reddit))
-    logger.debug('Downloading images from "%s" subreddit' % (ARGS.reddit))
+    for JOB in JOBS:
+        print('Downloading images from "%s" subreddit' % (JOB.reddit))
+        logger.debug('Downloading images from "%s" subreddit' % (JOB.reddit))
 
-    TOTAL = DOWNLOADED = ERRORS = SKIPPED = FAILED = 0
-    FINISHED = False
-
-    # Create the specified directory if it doesn't already exist.
+    # Create the specified directories if they don't already exist.
     if not pathexists(ARGS.dir):
         mkdir(ARGS.dir)
-
-    # If a regex has been specified, compile the rule (once)
-    RE_RULE = None
-    if ARGS.regex:
-        RE_RULE = re.compile(ARGS.regex)
-
-    LAST = ARGS.last
-
-    while not FINISHED:
-        ITEMS = getitems(ARGS.reddit, LAST)
-        if not ITEMS:
-            # No more items to process
-            break
-
-        for ITEM in ITEMS:
-            TOTAL += 1
-            IDENTIFIER = ITEM['title'].replace('/', '\'').replace('"', '\'').replace('*', '\'').replace(':', '-').replace('?', '\'').replace('|', '-').replace('\\', '\'').replace('>','\'').replace('<','\'').replace('\n','-').replace('\t','-')
-
-            if ITEM['score'] < ARGS.score:
-                if ARGS.verbose:
-                    print('    SCORE: %s has score of %s which is lower than required score of %s.' % (ITEM['id'], ITEM['score'], ARGS.score))
-
-                SKIPPED += 1
-                continue
-            elif ARGS.sfw and ITEM['over_18']:
-                if ARGS.verbose:
-                    print('    NSFW: %s is marked as NSFW.' % (ITEM['id']))
-
-                SKIPPED += 1
-                continue
-            elif ARGS.nsfw and not ITEM['over_18']:
-                if ARGS.verbose:
-                    print('    Not NSFW, skipping %s' % (ITEM['id']))
-
-                SKIPPED += 1
-                continue
-            elif ARGS.regex and not re.match(RE_RULE, ITEM['title']):
-                if ARGS.verbose:
-                    print('    Regex match failed')
-
-                SKIPPED += 1
-                continue
-
-            FILECOUNT = 0
-            try:
-                URLS = extract_urls(ITEM['url'])
-            except HTTPError as ERROR:
-                print('    HTTP ERROR: Code %s. ID = %s.' % (ERROR.code, ITEM['id']))
-                logger.debug('    HTTP ERROR: Code %s. ID = %s.' % (ERROR.code, ITEM['id']))
-                FAILED+=1
-            for URL in URLS:
-                try:
-                    # Trim any http query off end of file extension.
-                    FILEEXT = pathsplitext(URL)[1]
-                    if '?' in FILEEXT:
-                        FILEEXT = FILEEXT[:FILEEXT.index('?')]
-
-                    # Only append numbers if more than one file.
-                    FILENUM = ('_%d' % FILECOUNT if len(URLS) > 1 else '')
-                    FILENAME = '%s%s%s%s%s' % (ITEM['id'], ' - ', IDENTIFIER, FILENUM, FILEEXT)
-                    FILEPATH = pathjoin(ARGS.dir, FILENAME)
-
-#                    # Improve debuggability list URL before download too.
-#                    print '    Attempting to download URL [%s] as [%s].' % (
-#                        URL.encode('utf-8'), FILENAME.encode('utf-8'))
-
-                    # Download the image
-                    download_from_url(URL, FILEPATH)
-
-                    # Image downloaded successfully!
-                    print('    Downloaded URL [%s] as [%s].' % (URL, FILENAME))
-                    logger.debug('    Downloaded URL [%s] as [%s].' % (URL, FILENAME))
-                    DOWNLOADED += 1
-                    FILECOUNT += 1
-                    time.sleep(2)
-                    if 0 < ARGS.num <= DOWNLOADED:
-                        FINISHED = True
-                        break
-                except WrongFileTypeException as ERROR:
-                    print('    %s' % (ERROR))
-                    logger.debug('    %s' % (ERROR))
-                    SKIPPED += 1
-                except FileExistsException as ERROR:
-                    print('    %s' % (ERROR))
-                    logger.debug('    %s' % (ERROR))
-                    ERRORS += 1
-                    if ARGS.update:
-                        print('    Update complete, exiting.')
-                        logger.debug('    Update complete, exiting.')
-                        FINISHED = True
-                        break
-                except HTTPError as ERROR:
-                    print('    HTTP ERROR: Code %s for %s. ID = %s' % (ERROR.code, URL, ITEM['id']))
-                    logger.debug('    HTTP ERROR: Code %s for %s. ID = %s' % (ERROR.code, URL, ITEM['id']))
-                    FAILED += 1
-                except URLError as ERROR:
-                    print('    URL ERROR: %s!' % (URL))
-                    logger.debug('    URL ERROR: %s!' % (URL))
-                    FAILED += 1
-                except InvalidURL as ERROR:
-                    print('    Invalid URL: %s!' % (URL))
-                    logger.debug('    Invalid URL: %s!' % (URL))
-                    FAILED += 1
-
-            if FINISHED:
+    for JOB in JOBS:
+        if not pathexists(JOB.dir):
+            makedirs(JOB.dir)
+
+    INDEX = DownloadIndex(ARGS.index or pathjoin(ARGS.dir, INDEX_NAME))
+    for JOB in JOBS:
+        IMPORTED = INDEX.import_dir(JOB.dir, JOB.reddit, ARGS.reimport)
+        if IMPORTED:
+            print('    Indexed %d existing files in %s.' % (IMPORTED, JOB.dir))
+            logger.debug('    Indexed %d existing files in %s.' % (IMPORTED, JOB.dir))
+
+    CACHE = None
+    if not ARGS.no_cache:
+        CACHE = ResolverCache(ARGS.cache or pathjoin(ARGS.dir, CACHE_NAME),
+                              ARGS.cache_ttl, ARGS.cache_negative_ttl, ARGS.cache_size)
+
+    PHASHES = None
+    if ARGS.similar is not None:
+        PHASHES = phash.PHashIndex(INDEX.phashes())
+
+    # Keep a pooled connection per worker for each host, and pace every
+    # request through the limiter.
+    LIMITER = HostLimiter(HOST_LIMITS, DEFAULT_HOST_LIMIT, ARGS.host_delay, ARGS.host_burst)
+    httpsession.configure(max(httpsession.POOL_SIZE, ARGS.workers), LIMITER, ARGS.retries)
+    variants.configure(ARGS.variant, ARGS.max_bytes)
+    POSTPROCESSOR = None
+    if ARGS.thumbnail or ARGS.strip_metadata or ARGS.convert:
+        POSTPROCESSOR = postprocess.PostProcessor(postprocess.Options(ARGS.thumbnail, ARGS.strip_metadata, ARGS.convert),
+                                                  ARGS.post_workers)
+
+    # Pick up where an interrupted run left off. Manifests are worked
+    # through again instead: the index skips what is already done.
+    JOURNAL = None
+    if not (ARGS.no_journal or ARGS.resolve or ARGS.fetch):
+        JOURNAL = Journal(ARGS.journal or pathjoin(ARGS.dir, JOURNAL_NAME))
+        for JOB in JOBS:
+            CURSOR = JOURNAL.cursors.get(JOB.reddit)
+            if CURSOR:
+                # The counters carry on only along with the posts they
+                # counted.
+                if JOURNAL.resumed_posts(JOB.reddit):
+                    JOB.stats.update(CURSOR['stats'])
+                JOB.newest = max(JOB.newest, CURSOR['newest'])
+                # -watch reads the top of the listing, never from a place
+                # in it.
+                if not JOB.last and not BACKFILL and not ARGS.watch:
+                    JOB.last = CURSOR['last']
+
+    BANDWIDTH = Bandwidth(ARGS.bandwidth) if ARGS.bandwidth else None
+    MANIFEST = ManifestWriter(ARGS.resolve, MANIFEST_OUT) if ARGS.resolve else None
+    DOWNLOADER = Downloader(ARGS, INDEX, CACHE, PHASHES, LIMITER, BANDWIDTH, LAYOUT, POSTPROCESSOR, JOURNAL, logger,
+                            MANIFEST)
+
+    INTERRUPTED = False
+    try:
+        # Finish the posts an interrupted run left behind, without
+        # listing or resolving them again.
+        for JOB in JOBS:
+            RESUMED = JOURNAL.resumed_posts(JOB.reddit) if JOURNAL is not None else []
+            if RESUMED:
+                print('Resuming %d posts of "%s" from the journal.' % (len(RESUMED), JOB.reddit))
+                logger.debug('Resuming %d posts of "%s" from the journal.' % (len(RESUMED), JOB.reddit))
+                DOWNLOADER.queue_items(JOB, [Post(**FIELDS) for FIELDS, _, _ in RESUMED],
+                                       {FIELDS['id']: URLS for FIELDS, URLS, _ in RESUMED}, resumed=True,
+                                       guessed={FIELDS['id'] for FIELDS, _, GUESSED in RESUMED if GUESSED})
+
+        # Download what -resolve runs have listed. Posts of subreddits
+        # without a job of their own go to a folder of their name.
+        JOBS_BY_NAME = {JOB.reddit.lower(): JOB for JOB in JOBS}
+        for PAGE in manifest.iterpages(ARGS.fetch):
+            GROUPS = {}
+            for POST, URLS in PAGE:
+                GROUPS.setdefault(POST.subreddit or 'unknown', []).append((POST, URLS))
+            for NAME, ENTRIES in GROUPS.items():
+                JOB = JOBS_BY_NAME.get(NAME.lower())
+                if JOB is None:
+                    JOB = Job(NAME, pathjoin(ARGS.dir, NAME), **job_defaults(ARGS))
+                    if not pathexists(JOB.dir):
+                        makedirs(JOB.dir)
+                    JOBS.append(JOB)
+                    JOBS_BY_NAME[NAME.lower()] = JOB
+                if not JOB.finished:
+                    DOWNLOADER.queue_items(JOB, [POST for POST, _ in ENTRIES],
+                                           {POST.id: URLS for POST, URLS in ENTRIES})
+        if ARGS.fetch:
+            for JOB in JOBS:
+                JOB.finished = True
+
+        # Take one listing page from each subreddit in turn so they all
+        # make progress over the shared workers.
+        while True:
+            ACTIVE = [JOB for JOB in JOBS if not JOB.finished]
+            if not ACTIVE:
                 break
 
-        LAST = ITEM['id']
-
-    print('Downloaded %d files (Processed %d, Skipped %d, Exists %d)' % (DOWNLOADED, TOTAL, SKIPPED, ERRORS))
-    logger.debug('Downloaded %d files (Processed %d, Skipped %d, Exists %d)' % (DOWNLOADED, TOTAL, SKIPPED, ERRORS))
+            for JOB in ACTIVE:
+                if JOB.pages is None:
+                    if BACKFILL:
+                        JOB.pages = backfill.iterpages(JOB.reddit, BACKFILL[0], BACKFILL[1], INDEX,
+                                                       int(ARGS.backfill_window * 86400), ARGS.backfill_workers)
+                    else:
+                        JOB.pages = iterpages(JOB.reddit, JOB.last, ARGS.readahead, JOB.sort)
+                try:
+                    ITEMS = next(JOB.pages, None)
+                except ListingError as ERROR:
+                    # Give up on this subreddit; the others carry on.
+                    print('    %s Stopping "%s".' % (ERROR, JOB.reddit))
+                    logger.debug('    %s Stopping "%s".' % (ERROR, JOB.reddit))
+                    JOB.finished = True
+                    continue
+                if not ITEMS:
+                    # No more items to process
+                    JOB.finished = True
+                    continue
+
+                DOWNLOADER.queue_items(JOB, ITEMS)
+                if JOB.finished:
+                    JOB.pages.close()
+
+        if ARGS.watch:
+            print('Watching for new posts, press Ctrl-C to stop.')
+            watch_jobs(JOBS, DOWNLOADER, ARGS.watch_min, ARGS.watch_max)
+    except KeyboardInterrupt:
+        print('Interrupted, finishing downloads in progress.')
+        logger.debug('Interrupted, finishing downloads in progress.')
+        INTERRUPTED = True
+
+    DOWNLOADER.close(INTERRUPTED)
+    if MANIFEST is not None:
+        MANIFEST.close()
+    if JOURNAL is not None:
+        # A complete run leaves nothing to resume, and neither does -watch
+        # (which only ends when interrupted) once every post is done.
+        JOURNAL.close(clear=not INTERRUPTED or (ARGS.watch and not JOURNAL.pending))
+    INDEX.close()
+    if CACHE is not None:
+        if ARGS.verbose:
+            print('    Resolver cache: %d hits, %d misses.' % (CACHE.hits, CACHE.misses))
+        CACHE.close()
+
+    STATS = Counter()
+    for JOB in JOBS:
+        STATS.update(JOB.stats)
+        if JOB.update and JOB.stats['exists']:
+            print('    Update of "%s" complete.' % (JOB.reddit))
+            logger.debug('    Update of "%s" complete.' % (JOB.reddit))
+        if len(JOBS) > 1:
+            print('%s: Downloaded %d files (Processed %d, Skipped %d, Exists %d, Failed %d)' % (JOB.reddit, JOB.stats['downloaded'], JOB.stats['total'], JOB.stats['skipped'], JOB.stats['exists'], JOB.stats['failed']))
+            logger.debug('%s: Downloaded %d files (Processed %d, Skipped %d, Exists %d, Failed %d)' % (JOB.reddit, JOB.stats['downloaded'], JOB.stats['total'], JOB.stats['skipped'], JOB.stats['exists'], JOB.stats['failed']))
+
+    print('Downloaded %d files (Processed %d, Skipped %d, Exists %d)' % (STATS['downloaded'], STATS['total'], STATS['skipped'], STATS['exists']))
+    logger.debug('Downloaded %d files (Processed %d, Skipped %d, Exists %d)' % (STATS['downloaded'], STATS['total'], STATS['skipped'], STATS['exists']))
+    if STATS['linked']:
+        print('Linked %d duplicate files.' % (STATS['linked']))
+        logger.debug('Linked %d duplicate files.' % (STATS['linked']))
+    if STATS['similar']:
+        print('Found %d near-duplicate images.' % (STATS['similar']))
+        logger.debug('Found %d near-duplicate images.' % (STATS['similar']))
+    if STATS['processed']:
+        print('Post-processed %d files.' % (STATS['processed']))
+        logger.debug('Post-processed %d files.' % (STATS['processed']))
+    if STATS['filtered']:
+        print('Filtered out %d files by size.' % (STATS['filtered']))
+        logger.debug('Filtered out %d files by size.' % (STATS['filtered']))
+    if MANIFEST is not None:
+        print('Wrote %d resolved posts to %s.' % (MANIFEST.posts, ARGS.resolve))
+        logger.debug('Wrote %d resolved posts to %s.' % (MANIFEST.posts, ARGS.resolve))
+    if DOWNLOADER.speculator is not None:
+        for RULE, COUNTS in sorted(DOWNLOADER.speculator.summary().items()):
+            print('Guessed %s URLs: %d right, %d wrong.' % (RULE, COUNTS['hits'], COUNTS['misses']))
+            logger.debug('Guessed %s URLs: %d right, %d wrong.' % (RULE, COUNTS['hits'], COUNTS['misses']))
+
+    write_reports(ARGS, JOBS, DOWNLOADER.speculator)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""On-disk cache of resolved post URLs."""
+
+import json
+import sqlite3
+import threading
+import time
+
+# Default cache file name, created inside the download directory.
+CACHE_NAME = '.redditimagegrab-cache.db'
+
+# Seconds a successful resolution stays valid.
+DEFAULT_TTL = 7 * 24 * 3600
+
+# Seconds a failed resolution is remembered before it is tried again.
+DEFAULT_NEGATIVE_TTL = 3600
+
+# Entries kept before the least recently used ones are evicted.
+DEFAULT_MAX_ENTRIES = 100000
+
+# Evict after this many new entries rather than on every write.
+EVICT_EVERY = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resolved (
+    url TEXT PRIMARY KEY,
+    urls TEXT,
+    error TEXT,
+    expires REAL NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resolved_used ON resolved (used);
+"""
+
+
+class ResolverCache(object):
+    """
+    Maps a post URL to the list of direct URLs it resolved to.
+
+    Failed resolutions are cached too (with their error message) for a
+    shorter time, so a dead album isn't fetched again on every run.
+    Expired entries are ignored, and once the cache holds more than
+    max_entries the least recently used ones are evicted.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def __contains__(self, url):
+        """Return True if there is a valid entry for url."""
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM resolved WHERE url = ? AND expires > ?',
+                                    (url, time.time())).fetchone() is not None
+
+    def get(self, url):
+        """
+        Return (urls, error) cached for url, where exactly one of the two
+        is None, or None if there is no valid entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT urls, error FROM resolved WHERE url = ? AND expires > ?',
+                                   (url, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE resolved SET used = ? WHERE url = ?', (now, url))
+        urls, error = row
+        return (json.loads(urls) if urls is not None else None), error
+
+    def put(self, url, urls):
+        """Cache the direct URLs url resolved to."""
+        self._store(url, json.dumps(urls), None, self.ttl)
+
+    def put_failure(self, url, error):
+        """Remember that resolving url failed with message error."""
+        self._store(url, None, str(error), self.negative_ttl)
+
+    def _store(self, url, urls, error, ttl):
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO resolved VALUES (?, ?, ?, ?, ?)',
+                             (url, urls, error, now + ttl, now))
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute('DELETE FROM resolved WHERE expires <= ?', (now,))
+        self._db.execute('DELETE FROM resolved WHERE url IN '
+                         '(SELECT url FROM resolved ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._evict(time.time())
+            self._db.commit()
+            self._db.close()
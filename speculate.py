@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Guessing the direct file URL of a post from its link alone.
+
+Some links that otherwise take an API request to resolve follow a fixed
+pattern: a gfycat page is nearly always the webm of the same name on
+giant.gfycat.com. Downloading the guess straight away saves the
+resolver's request. When the guess turns out wrong (HTTP 404 or not an
+image) the caller resolves the link properly instead.
+"""
+
+import re
+import threading
+from collections import Counter
+
+# (rule name, pattern of post URLs, direct URL template filled with the
+# pattern's groups).
+RULES = (
+    ('gfycat', re.compile(r'^https?://(?:www\.)?gfycat\.com/([A-Za-z0-9]+)$'), 'http://giant.gfycat.com/{0}.webm'),
+)
+
+# Guesses a rule gets before its hit rate is judged, and the hit rate
+# below which it is no longer used.
+MIN_TRIES = 20
+MIN_HIT_RATE = 0.5
+
+
+def predict(url):
+    """Return (rule name, direct URL) guessed for the post link url, or None."""
+    for name, pattern, template in RULES:
+        match = pattern.match(url)
+        if match:
+            return name, template.format(*match.groups())
+    return None
+
+
+class Speculator(object):
+    """
+    Hands out guesses from RULES and keeps each rule's hits and misses.
+    A rule that misses too often (MIN_HIT_RATE over at least MIN_TRIES
+    guesses) is switched off for the rest of the run, so a host that
+    changed its layout costs no more than a few wasted requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def enabled(self, rule):
+        tries = self.hits[rule] + self.misses[rule]
+        return tries < MIN_TRIES or self.hits[rule] >= MIN_HIT_RATE * tries
+
+    def guess(self, url):
+        """Return the direct URL guessed for url, or None when no enabled rule applies."""
+        guessed = predict(url)
+        if guessed is None:
+            return None
+        with self._lock:
+            if not self.enabled(guessed[0]):
+                return None
+        return guessed[1]
+
+    def record(self, url, hit):
+        """Count whether the guess for the post link url was right."""
+        guessed = predict(url)
+        if guessed is not None:
+            with self._lock:
+                (self.hits if hit else self.misses)[guessed[0]] += 1
+
+    def summary(self):
+        """Return {rule: {'hits', 'misses', 'hit_rate'}} for the rules used so far."""
+        with self._lock:
+            return {rule: {'hits': self.hits[rule], 'misses': self.misses[rule],
+                           'hit_rate': self.hits[rule] / (self.hits[rule] + self.misses[rule])}
+                    for rule in set(self.hits) | set(self.misses)}
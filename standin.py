@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the sites redditdownload.py talks to.
+
+Serves a reddit listing (and timestamp search) of generated posts, the
+imgur album pages, gfycat
+cajax calls, imgrush API and DeviantArt pages those posts link to, and
+the images themselves, with configurable latency, bandwidth and error
+rate. Requests are told apart by their Host header, so point
+httpsession at it by setting REDDITIMAGEGRAB_STANDIN to its URL.
+"""
+
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from httpsession import STANDIN_ENV
+
+# Posts in one listing page, as on reddit.
+PAGE_SIZE = 25
+
+# Posts a listing or search reaches before it stops, as on reddit.
+LISTING_CAP = 1000
+
+# Listing requests allowed per rate limit period, as reddit announces in
+# its X-Ratelimit headers.
+RATELIMIT_REQUESTS = 600
+RATELIMIT_PERIOD = 600
+
+# Images in each album.
+ALBUM_SIZE = 3
+
+# Share of each kind of post in the listing.
+DEFAULT_MIX = {'image': 0.5, 'direct': 0.1, 'album': 0.1, 'gfycat': 0.1,
+               'gfyalbum': 0.05, 'imgrush': 0.1, 'deviantart': 0.05}
+
+# Share of gfycat names whose webm is on zippy.gfycat.com instead of
+# giant.gfycat.com, so that guessing the direct URL sometimes fails.
+GFYCAT_ZIPPY = 0.2
+
+# How many times larger a gif is than the other files.
+GIF_SCALE = 8
+
+# Image dimensions handed out to generated files.
+DIMENSIONS = ((640, 480), (1280, 720), (1920, 1080), (2560, 1440), (3840, 2160))
+
+# Size of the writes the body is sent in when bandwidth is limited.
+SEND_CHUNK = 16 * 1024
+
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png', '.gif': 'image/gif',
+                 '.webm': 'video/webm', '.mp4': 'video/mp4'}
+
+
+def parse_mix(value):
+    """Parse 'kind=share,...' into a dict, raising ValueError on bad input."""
+    mix = {}
+    for part in value.split(','):
+        kind, _, share = part.partition('=')
+        if kind not in DEFAULT_MIX:
+            raise ValueError('unknown post kind %r (one of %s)' % (kind, ', '.join(sorted(DEFAULT_MIX))))
+        mix[kind] = float(share)
+    return mix
+
+
+def percentile(values, share):
+    """Return the value share (0 to 100) of the way through sorted values."""
+    if not values:
+        return 0.0
+    return values[int(round(share / 100.0 * (len(values) - 1)))]
+
+
+def image_header(ext, width, height):
+    """Return the first bytes of a file of type ext with the given size."""
+    if ext == '.jpg':
+        return (b'\xff\xd8\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3)
+                + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01')
+    if ext == '.png':
+        ihdr = b'IHDR' + struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+        return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + ihdr
+                + struct.pack('>I', zlib.crc32(ihdr)))
+    if ext == '.gif':
+        return b'GIF89a' + struct.pack('<HH', width, height)
+    if ext == '.webm':
+        def element(ident, data):
+            return ident + bytes([0x80 | len(data)]) + data
+        video = element(b'\xe0', element(b'\xb0', struct.pack('>H', width))
+                        + element(b'\xba', struct.pack('>H', height)))
+        tracks = element(b'\x16\x54\xae\x6b', element(b'\xae', element(b'\xd7', b'\x01') + video))
+        return (element(b'\x1a\x45\xdf\xa3', b'\x42\x82\x84webm')
+                + b'\x18\x53\x80\x67\x01\xff\xff\xff\xff\xff\xff\xff' + tracks)
+    return b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+
+
+class StandinServer(object):
+    """
+    The stand-in sites, served from a background thread.
+
+    Attributes:
+        url      - base URL to set REDDITIMAGEGRAB_STANDIN to
+        posts    - the generated posts, newest first
+    """
+
+    def __init__(self, posts=500, mix=None, image_size=200000, latency=0.0, bandwidth=0,
+                 error_rate=0.0, seed=0, port=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.image_size = image_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._errors = {}
+        self._bytes = {}
+        self._period_end = 0.0
+        self._used = 0
+        # Image bodies are cut from one block of random bytes.
+        self._filler = random.Random(seed).randbytes(image_size * 3 // 2 * GIF_SCALE)
+        self.posts = self._make_posts(posts, mix or DEFAULT_MIX)
+        self._positions = {post['id']: number for number, post in enumerate(self.posts)}
+
+        standin = self
+
+        class Handler(StandinHandler):
+            server_standin = standin
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        self._thread = None
+
+    def _make_posts(self, count, mix):
+        kinds = sorted(mix)
+        weights = [mix[kind] for kind in kinds]
+        posts = []
+        first = int('100000', 36)
+        for number in range(count):
+            post_id = base36(first + count - number)
+            kind = self._random.choices(kinds, weights)[0]
+            if kind == 'image':
+                url, domain = 'http://i.imgur.com/%s.jpg' % post_id, 'i.imgur.com'
+            elif kind == 'direct':
+                url, domain = 'http://i.example.com/%s.png' % post_id, 'i.example.com'
+            elif kind == 'album':
+                url, domain = 'http://imgur.com/a/%s' % post_id, 'imgur.com'
+            elif kind == 'gfycat':
+                url, domain = 'http://gfycat.com/Gfy%s' % post_id, 'gfycat.com'
+            elif kind == 'gfyalbum':
+                url, domain = 'http://gfycat.com/someone/album%s' % post_id, 'gfycat.com'
+            elif kind == 'imgrush':
+                url, domain = 'https://imgrush.com/%s' % post_id, 'imgrush.com'
+            else:
+                url, domain = 'http://artist.deviantart.com/art/Picture-%s' % post_id, 'artist.deviantart.com'
+            posts.append({'id': post_id, 'title': 'Post %s (%s)' % (post_id, kind), 'url': url,
+                          'domain': domain, 'score': self._random.randint(1, 5000), 'over_18': False,
+                          'created_utc': 1400000000 + count - number, 'subreddit': 'bench'})
+        return posts
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def should_fail(self, stage):
+        """Roll for whether to answer this request with an error."""
+        return stage != 'listing' and self._random.random() < self.error_rate
+
+    def ratelimit(self):
+        """
+        Return reddit's X-Ratelimit headers for another listing request,
+        allowing RATELIMIT_REQUESTS per RATELIMIT_PERIOD seconds.
+        """
+        with self._lock:
+            now = time.time()
+            if now >= self._period_end:
+                self._period_end = now + RATELIMIT_PERIOD
+                self._used = 0
+            self._used += 1
+            return {'X-Ratelimit-Used': str(self._used),
+                    'X-Ratelimit-Remaining': '%.1f' % max(RATELIMIT_REQUESTS - self._used, 0),
+                    'X-Ratelimit-Reset': str(int(self._period_end - now))}
+
+    def record(self, stage, seconds, sent, failed):
+        with self._lock:
+            self._timings.setdefault(stage, []).append(seconds)
+            self._bytes[stage] = self._bytes.get(stage, 0) + sent
+            if failed:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def stats(self):
+        """
+        Return {stage: {'requests', 'errors', 'bytes', 'p50', 'p90', 'p99'}}
+        with the time spent serving each kind of request, in seconds.
+        """
+        with self._lock:
+            result = {}
+            for stage, timings in self._timings.items():
+                timings = sorted(timings)
+                result[stage] = {'requests': len(timings), 'errors': self._errors.get(stage, 0),
+                                 'bytes': self._bytes.get(stage, 0), 'p50': percentile(timings, 50),
+                                 'p90': percentile(timings, 90), 'p99': percentile(timings, 99)}
+            return result
+
+    def route(self, host, path, query):
+        """
+        Return (stage, status, content type, body) answering a GET of path
+        on host.
+        """
+        if host.startswith('www.reddit.com') or host == 'reddit.com':
+            if path.endswith('/search.json'):
+                return ('listing',) + self.listing(query, self.search(query))
+            return ('listing',) + self.listing(query)
+        if host == 'imgur.com' and path.startswith('/a/'):
+            hashes = ''.join('"hash":"%s",' % imghash for imghash in self.album(path[3:]))
+            page = '<html>\n<head><title>Album</title></head>\n<body>\n<script>\nvar album = {%s};\n</script>\n</body>\n</html>\n' % hashes
+            return 'album', 200, 'text/html; charset=utf-8', page.encode()
+        if host == 'gfycat.com' and path.startswith('/cajax/'):
+            return ('gfycat',) + self.gfycat(path, query)
+        if host == 'imgrush.com' and path.startswith('/api/'):
+            return ('imgrush',) + self.imgrush(path[5:], query)
+        if host.endswith('deviantart.com'):
+            page = ('<html><body><div class="dev-view-deviation"><img alt="Picture" '
+                    'class="dev-content-normal" src="http://fc00.deviantart.net/%s.jpg"></div></body></html>'
+                    % path.rsplit('-', 1)[-1])
+            return 'deviantart', 200, 'text/html; charset=utf-8', page.encode()
+        return ('image',) + self.image(host + path)
+
+    def search(self, query):
+        """Return the posts matching a 'timestamp:START..END' search."""
+        start, _, end = query.get('q', [''])[0].partition('timestamp:')[2].partition('..')
+        if not (start.isdigit() and end.isdigit()):
+            return []
+        return [post for post in self.posts if int(start) <= post['created_utc'] <= int(end)]
+
+    def listing(self, query, posts=None):
+        posts = (self.posts if posts is None else posts)[:LISTING_CAP]
+        after = query.get('after', [''])[0][3:]
+        start = 0
+        if after and posts:
+            # Search results are a run of self.posts, so positions carry over.
+            start = max(self._positions.get(after, -1) - self._positions[posts[0]['id']] + 1, 0)
+        children = [{'kind': 't3', 'data': post} for post in posts[start:start + PAGE_SIZE]]
+        last = children[-1]['data']['id'] if children else None
+        body = {'kind': 'Listing', 'data': {'children': children, 'after': last and 't3_' + last}}
+        return 200, 'application/json; charset=UTF-8', json.dumps(body).encode()
+
+    def album(self, album_id):
+        return ['%sa%d' % (album_id, number) for number in range(ALBUM_SIZE)]
+
+    def gfycat_webm(self, name):
+        """Return the URL of the webm of gfycat name."""
+        host = 'zippy' if random.Random(name).random() < GFYCAT_ZIPPY else 'giant'
+        return 'http://%s.gfycat.com/%s.webm' % (host, name)
+
+    def gfycat_item(self, name):
+        """Return the API's description of gfycat name, with its encodings and their sizes."""
+        item = {'gfyName': name}
+        webm = self.gfycat_webm(name)
+        for ext in ('webm', 'mp4', 'gif'):
+            url = webm[:-len('webm')] + ext
+            item[ext + 'Url'] = url
+            item[ext + 'Size'] = self.shape(url[len('http://'):])[2]
+        return item
+
+    def gfycat(self, path, query):
+        if path.startswith('/cajax/get/'):
+            name = path[len('/cajax/get/'):]
+            body = {'gfyItem': self.gfycat_item(name)}
+        elif path.startswith('/cajax/getPublicAlbumContents'):
+            album = query.get('albumUrl', [''])[0]
+            body = {'publishedGfys': [self.gfycat_item(name) for name in self.album(album)],
+                    'title': album}
+        else:
+            return 404, 'application/json', b'{"error": "not found"}'
+        return 200, 'application/json', json.dumps(body).encode()
+
+    def gfycat_moved(self, name):
+        """Return True if name is a gfycat file on the wrong one of its hosts."""
+        host, _, path = name.partition('/')
+        if host not in ('giant.gfycat.com', 'zippy.gfycat.com'):
+            return False
+        return not self.gfycat_webm(path[:path.rfind('.')]).startswith('http://%s/' % host)
+
+    def imgrush(self, call, query):
+        def describe(imghash):
+            return {'files': [{'url': 'https://imgrush.com/%s.mp4' % imghash, 'type': 'video/mp4'},
+                              {'url': 'https://imgrush.com/%s.webm' % imghash, 'type': 'video/webm'}],
+                    'original': 'https://imgrush.com/%s.gif' % imghash, 'type': 'image/gif'}
+        if call == 'info':
+            body = {imghash: describe(imghash) for imghash in query.get('list', [''])[0].split(',') if imghash}
+        else:
+            body = describe(call)
+        return 200, 'application/json', json.dumps(body).encode()
+
+    def shape(self, name):
+        """Return (width, height, size in bytes) of the file name (host and path)."""
+        pick = random.Random(name)
+        width, height = pick.choice(DIMENSIONS)
+        size = pick.randint(self.image_size // 2, self.image_size * 3 // 2)
+        if name.endswith('.gif'):
+            size *= GIF_SCALE
+        return width, height, size
+
+    def image(self, name):
+        ext = name[name.rfind('.'):] if '.' in name.rsplit('/', 1)[-1] else ''
+        if ext not in CONTENT_TYPES or self.gfycat_moved(name):
+            return 404, 'text/html', b'<html>Not found</html>'
+        width, height, size = self.shape(name)
+        header = image_header(ext, width, height)
+        return 200, CONTENT_TYPES[ext], header + self._filler[:max(size - len(header), 0)]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_standin = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        standin = self.server_standin
+        started = time.perf_counter()
+        host = (self.headers.get('Host') or '').split(':')[0]
+        parts = urlsplit(self.path)
+        stage, status, content_type, body = standin.route(host, parts.path, parse_qs(parts.query))
+        if standin.latency:
+            time.sleep(standin.latency)
+
+        failed = standin.should_fail(stage)
+        headers = {}
+        if stage == 'listing':
+            headers.update(standin.ratelimit())
+        if failed:
+            status, content_type, body = 503, 'text/html', b'<html>Service Unavailable</html>'
+        elif status == 200 and stage == 'image':
+            match = (self.headers.get('Range') or '').partition('bytes=')[2].partition('-')
+            if match[0].isdigit() and int(match[0]) < len(body):
+                start = int(match[0])
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, len(body) - 1, len(body))
+                status, body = 206, body[start:]
+
+        sent = 0
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            if not head:
+                sent = self.send_body(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients hang up early on purpose (size filters, scrapers).
+            self.close_connection = True
+        standin.record(stage, time.perf_counter() - started, sent, failed or status >= 400)
+
+    def send_body(self, body):
+        bandwidth = self.server_standin.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return len(body)
+        started = time.perf_counter()
+        for start in range(0, len(body), SEND_CHUNK):
+            self.wfile.write(body[start:start + SEND_CHUNK])
+            ahead = (start + SEND_CHUNK) / float(bandwidth) - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+        return len(body)
+
+
+def base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+    while number:
+        number, digit = divmod(number, 36)
+        text = digits[digit] + text
+    return text or '0'
+
+
+def add_server_arguments(parser):
+    """Add the options that shape a StandinServer to an ArgumentParser."""
+    parser.add_argument('-posts', metavar='N', default=500, type=int, required=False, help='Number of posts in the listing.')
+    parser.add_argument('-mix', metavar='KIND=SHARE,...', default=None, required=False, help='Share of each kind of post (%s).' % ', '.join(sorted(DEFAULT_MIX)))
+    parser.add_argument('-image-size', metavar='BYTES', default=200000, type=int, required=False, help='Average size of the generated files.')
+    parser.add_argument('-latency', metavar='SECONDS', default=0.0, type=float, required=False, help='Delay before every answer.')
+    parser.add_argument('-bandwidth', metavar='BYTES', default=0, type=int, required=False, help='Bytes per second sent on each connection (0 for no limit).')
+    parser.add_argument('-error-rate', metavar='SHARE', default=0.0, type=float, required=False, help='Share of requests (other than listings) answered with HTTP 503.')
+    parser.add_argument('-seed', metavar='N', default=0, type=int, required=False, help='Seed for the generated posts.')
+
+
+def server_from_arguments(args, port=0):
+    """Return a StandinServer set up from options added by add_server_arguments."""
+    return StandinServer(args.posts, parse_mix(args.mix) if args.mix else None, args.image_size,
+                         args.latency, args.bandwidth, args.error_rate, args.seed, port)
+
+
+if __name__ == "__main__":
+    PARSER = ArgumentParser(description='Serves stand-ins for reddit and the image hosts.')
+    PARSER.add_argument('-port', metavar='N', default=8000, type=int, required=False, help='Port to listen on.')
+    add_server_arguments(PARSER)
+    ARGS = PARSER.parse_args()
+    try:
+        SERVER = server_from_arguments(ARGS, ARGS.port)
+    except ValueError as ERROR:
+        PARSER.error(str(ERROR))
+    print('Serving on %s, run redditdownload.py with %s=%s' % (SERVER.url, STANDIN_ENV, SERVER.url))
+    try:
+        SERVER.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
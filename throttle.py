@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Per-host concurrency limits, adaptive request pacing, retry backoff and
+circuit breaking for everything the script fetches.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.error import URLError
+
+# How many transfers may run against a single host at once, unless the
+# host (or one of its parent domains) is listed in HOST_LIMITS.
+DEFAULT_HOST_LIMIT = 2
+
+# Average number of seconds between two requests to the same host.
+DEFAULT_HOST_DELAY = 1.0
+
+# Requests to a host that may go out back to back before the delay applies.
+DEFAULT_HOST_BURST = 4
+
+# Times a failed request (connection error, HTTP 429 or 5xx) is retried.
+DEFAULT_RETRIES = 3
+
+# Answers worth retrying.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Answers that mean the host wants fewer requests.
+THROTTLE_STATUSES = (429, 503)
+
+# Retry backoff: the n-th retry waits a random time up to
+# BACKOFF_BASE * 2**n seconds, but no more than BACKOFF_MAX.
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# Longest Retry-After that is honoured, in seconds.
+MAX_RETRY_AFTER = 300.0
+
+# Requests per second a host without a configured rate drops to when it
+# first throttles us, the lowest rate it can be slowed to, and how much
+# the rate grows back with every success.
+THROTTLED_RATE = 10.0
+MIN_RATE = 0.05
+RATE_RECOVERY = 1.05
+
+# Consecutive failures that open a host's circuit, and how long it stays
+# open (doubling, up to BREAKER_MAX_COOLDOWN, while the host keeps failing).
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+BREAKER_MAX_COOLDOWN = 600.0
+
+HOST_LIMITS = {
+    'i.imgur.com': 4,
+    'imgur.com': 2,
+    'gfycat.com': 2,
+    'imgrush.com': 2,
+    'deviantart.com': 1,
+}
+
+
+def parse_host_limits(values):
+    """
+    Parse a list of 'host=N' strings (as given to -host-limit) into a dict.
+
+    Raises:
+        ValueError when an entry is malformed.
+    """
+    limits = {}
+    for value in values or []:
+        host, sep, limit = value.partition('=')
+        if not sep or not host or not limit.isdigit() or int(limit) < 1:
+            raise ValueError('Bad host limit "%s", expected host=N.' % value)
+        limits[host.lower()] = int(limit)
+    return limits
+
+
+def backoff_delay(attempt):
+    """Return how long to wait before retry number attempt (from 0), with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(value):
+    """
+    Return the seconds a Retry-After header (delay seconds or an HTTP
+    date) asks for, or None if it can't be parsed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class HostUnavailableError(URLError):
+    """Raised instead of sending a request to a host whose circuit is open"""
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average and up to burst at once.
+    A rate of None means no limit.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def reserve(self, now, count=1):
+        """
+        Take count tokens and return the seconds to wait before using
+        them. The count goes negative while requests are waiting, so they
+        queue up in turn.
+        """
+        if not self.rate:
+            self.stamp = now
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= count
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class Bandwidth(object):
+    """
+    Caps the bytes per second of all transfers together (-bandwidth),
+    allowing up to a second's worth at once.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, rate)
+
+    def take(self, count):
+        """Account for count bytes received, sleeping as long as the cap asks. Returns the seconds slept."""
+        with self._lock:
+            wait = self._bucket.reserve(time.monotonic(), count)
+        if wait > 0:
+            time.sleep(wait)
+            return wait
+        return 0.0
+
+
+class HostState(object):
+    """Pacing and health of one host."""
+
+    def __init__(self, rate, burst):
+        self.ceiling = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+
+
+class HostLimiter(object):
+    """
+    Hands out download slots per host and paces every request.
+
+    Each host gets its own semaphore so that only a limited number of
+    transfers run against it at once. Requests are paced by a token
+    bucket per host, at one per `delay` seconds on average with bursts of
+    up to `burst`. The rate adapts to the host:
+
+    - reddit's X-Ratelimit-Remaining and X-Ratelimit-Reset headers set
+      the rate to spread the remaining requests over the rest of the
+      period, and stop requests when none are left;
+    - Retry-After stops requests to the host for as long as it asks;
+    - HTTP 429 and 503 halve the rate, and every success brings it back
+      up a little, never above the configured one;
+    - after BREAKER_THRESHOLD failures in a row the host's circuit opens
+      and requests to it fail straight away with HostUnavailableError
+      until a cooldown has passed. Then one failure opens it again, one
+      success closes it.
+    """
+
+    def __init__(self, limits=None, default_limit=DEFAULT_HOST_LIMIT, delay=DEFAULT_HOST_DELAY,
+                 burst=DEFAULT_HOST_BURST):
+        self.limits = dict(HOST_LIMITS)
+        self.limits.update(limits or {})
+        self.default_limit = default_limit
+        self.delay = delay
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._hosts = {}
+
+    def limit_key(self, host):
+        """
+        Return the domain in self.limits that host falls under (host itself
+        or a parent domain), or host when there is none.
+        """
+        host = (host or '').lower()
+        parts = host.split('.')
+        for i in range(len(parts) - 1):
+            suffix = '.'.join(parts[i:])
+            if suffix in self.limits:
+                return suffix
+        return host
+
+    def limit_for(self, host):
+        """Return the concurrency limit for host, checking parent domains too."""
+        return self.limits.get(self.limit_key(host), self.default_limit)
+
+    def _semaphore(self, host):
+        # Hosts under one limited domain share its slots.
+        key = self.limit_key(host)
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.BoundedSemaphore(self.limit_for(host))
+            return self._semaphores[key]
+
+    def _state(self, host):
+        # Called with the lock held.
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(1.0 / self.delay if self.delay > 0 else None, self.burst)
+        return state
+
+    def pace(self, host):
+        """
+        Sleep until it is this host's turn for another request.
+
+        Raises:
+            HostUnavailableError when the host's circuit is open.
+        """
+        host = (host or '').lower()
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            if state.open_until > now:
+                raise HostUnavailableError('%s is failing, not trying again for %d s' % (host, state.open_until - now))
+            wait = max(state.bucket.reserve(now), state.blocked_until - now)
+        if wait > 0:
+            time.sleep(wait)
+
+    def record(self, host, status=None, headers=None):
+        """
+        Learn from the answer to a request to host: its HTTP status and
+        headers, or no status when the request failed to connect.
+        """
+        host = (host or '').lower()
+        headers = headers or {}
+        with self._lock:
+            state = self._state(host)
+            bucket = state.bucket
+            now = time.monotonic()
+
+            wait = retry_after(headers.get('retry-after')) if status in THROTTLE_STATUSES else None
+            if wait is not None:
+                state.blocked_until = max(state.blocked_until, now + min(wait, MAX_RETRY_AFTER))
+
+            remaining = headers.get('x-ratelimit-remaining')
+            reset = headers.get('x-ratelimit-reset')
+            try:
+                remaining, reset = float(remaining), float(reset)
+            except (TypeError, ValueError):
+                remaining = reset = None
+            if remaining is not None:
+                if remaining < 1:
+                    state.blocked_until = max(state.blocked_until, now + min(reset, MAX_RETRY_AFTER))
+                elif reset > 0:
+                    bucket.rate = remaining / reset
+            elif status in THROTTLE_STATUSES:
+                bucket.rate = max(MIN_RATE, (bucket.rate or THROTTLED_RATE) / 2)
+            elif bucket.rate and bucket.rate != state.ceiling and status is not None and status < 400:
+                bucket.rate *= RATE_RECOVERY
+                if state.ceiling is None and bucket.rate >= THROTTLED_RATE:
+                    bucket.rate = None
+                elif state.ceiling is not None:
+                    bucket.rate = min(bucket.rate, state.ceiling)
+
+            if status is None or status in RETRY_STATUSES:
+                state.failures += 1
+                if state.failures >= BREAKER_THRESHOLD:
+                    if state.open_until:
+                        state.cooldown = min(state.cooldown * 2, BREAKER_MAX_COOLDOWN)
+                    state.open_until = now + state.cooldown
+            else:
+                state.failures = 0
+                state.open_until = 0.0
+                state.cooldown = BREAKER_COOLDOWN
+
+    @contextmanager
+    def slot(self, host):
+        """Hold one of host's transfer slots for the duration of the block."""
+        host = (host or '').lower()
+        with self._semaphore(host):
+            yield
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Picking which encoding of a clip to download.
+
+gfycat and imgrush serve each clip as webm and mp4, and often as a gif
+too, which is typically ten times the size of the others. choose() picks
+one by the configured policy, going by the sizes the API reported and
+asking the host with a HEAD request for the sizes it didn't.
+"""
+
+import threading
+from collections import namedtuple
+from os.path import splitext
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from http.client import InvalidURL
+
+import metrics
+from httpsession import urlopen
+
+# -variant policies: the smallest file, or the first of a container.
+POLICIES = ('smallest', 'webm', 'mp4', 'gif')
+DEFAULT_POLICY = 'smallest'
+
+# One encoding of a clip: its URL and size in bytes (None if unknown).
+Variant = namedtuple('Variant', 'url size', defaults=(None,))
+
+# gfycat API fields of each encoding, as (URL field, size field).
+GFYCAT_FIELDS = (('webmUrl', 'webmSize'), ('mp4Url', 'mp4Size'), ('gifUrl', 'gifSize'))
+
+_POLICY = DEFAULT_POLICY
+_MAX_BYTES = 0
+_LOCK = threading.Lock()
+
+
+def configure(policy=DEFAULT_POLICY, max_bytes=0):
+    """
+    Pick variants by policy (one of POLICIES) from now on. With max_bytes,
+    variants larger than that are passed over as long as one fits.
+    """
+    global _POLICY, _MAX_BYTES
+    with _LOCK:
+        _POLICY = policy
+        _MAX_BYTES = max_bytes
+
+
+def container(url):
+    """Return the container of the file at url going by its extension, such as 'webm'."""
+    return splitext(urlsplit(url).path)[1].lstrip('.').lower()
+
+
+def _size(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def gfycat_variants(item):
+    """Return the Variants of a gfycat API item (a gfyItem or album entry)."""
+    return [Variant(item.get(url_field), _size(item.get(size_field))) for url_field, size_field in GFYCAT_FIELDS]
+
+
+def imgrush_variants(info):
+    """Return the Variants of an imgrush API answer: its files, then the original."""
+    variants = [Variant(entry.get('url') or entry.get('file')) for entry in info.get('files', [])]
+    if isinstance(info.get('original'), str):
+        variants.append(Variant(info['original']))
+    return variants
+
+
+def probe_size(url):
+    """Return the Content-Length of url from a HEAD request, or None."""
+    try:
+        with metrics.timer('probe_size'):
+            with urlopen(url, method='HEAD') as response:
+                length = response.info().get('Content-Length')
+                # Reading the (empty) body hands the connection back to
+                # the pool.
+                response.read()
+    except (HTTPError, URLError, InvalidURL):
+        return None
+    return int(length) if length and length.isdigit() else None
+
+
+def choose(variants):
+    """
+    Return the URL of the variant the policy picks from variants, listed
+    in the order the API gave them, or None if none has a URL.
+
+    Sizes are only probed for when the choice depends on them: for a
+    container policy, only with max_bytes set or when no variant is in
+    that container.
+    """
+    with _LOCK:
+        policy, max_bytes = _POLICY, _MAX_BYTES
+    variants = [variant for variant in variants if variant.url]
+    if len(variants) <= 1:
+        return variants[0].url if variants else None
+
+    preferred = [variant for variant in variants if container(variant.url) == policy]
+    if preferred and not max_bytes:
+        return preferred[0].url
+
+    variants = [variant if variant.size is not None else variant._replace(size=probe_size(variant.url))
+                for variant in variants]
+    if max_bytes:
+        variants = [variant for variant in variants
+                    if variant.size is not None and variant.size <= max_bytes] or variants
+        preferred = [variant for variant in variants if container(variant.url) == policy]
+        if preferred:
+            return preferred[0].url
+
+    sized = [variant for variant in variants if variant.size is not None]
+    if not sized:
+        return variants[0].url
+    return min(sized, key=lambda variant: variant.size).url